@@ -0,0 +1,239 @@
+"""Offline end-to-end benchmark for ytam.
+
+Starts a local stand-in for the YouTube and Discogs endpoints, then times a Discogs lookup, title file parsing
+and a full Downloader run against it and prints the results as JSON. Streams are handed to the Downloader
+through a pre-seeded resolve cache, so pytube never touches the network.
+
+    python benchmarks/run.py --tracks 20 --size-mb 4 --jobs 4 --latency 0.05 --bandwidth 2048
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import contextlib
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import ytam.discogs as discogs  # noqa: E402
+import ytam.session as session  # noqa: E402
+import ytam.shaper as shaper  # noqa: E402
+from ytam.ytam import Downloader  # noqa: E402
+from ytam.title import TitleGenerator  # noqa: E402
+from ytam.artcache import ArtCache  # noqa: E402
+from ytam.resolvecache import ResolveCache  # noqa: E402
+from ytam.formats import FORMATS  # noqa: E402
+
+from server import MediaServer, Faults  # noqa: E402
+
+RELEASE_ID = "1000001"
+STREAM_ITAG = 140
+# seeded instead for formats that are remuxed from opus, so that the cached stream is the one they would pick
+OPUS_ITAG = 251
+
+
+class Stage:
+    def __init__(self):
+        self.calls = 0
+        self.seconds = 0.0
+
+    def as_dict(self):
+        return {
+            "calls": self.calls,
+            "total_s": round(self.seconds, 4),
+            "mean_s": round(self.seconds / self.calls, 4) if self.calls else 0.0,
+        }
+
+
+class TimedDownloader(Downloader):
+    """A Downloader that adds up the wall time spent in each of its pipeline stages."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.stages = {}
+
+    def timed(self, name, func, track):
+        start = time.perf_counter()
+        try:
+            return func(track)
+        finally:
+            stage = self.stages.setdefault(name, Stage())
+            stage.calls += 1
+            stage.seconds += time.perf_counter() - start
+
+    def fetch_track(self, track):
+        return self.timed("download", super().fetch_track, track)
+
+    def stream_track(self, track):
+        return self.timed("stream", super().stream_track, track)
+
+    def tag_track(self, track):
+        return self.timed("tag", super().tag_track, track)
+
+    def convert_track(self, track):
+        return self.timed("convert", super().convert_track, track)
+
+
+class StreamInfo:
+    def __init__(self, url, filesize, itag=STREAM_ITAG):
+        self.itag = itag
+        self.filesize = filesize
+        self.url = url
+
+
+class SlowResolveCache(ResolveCache):
+    """Stands in for the round-trips pytube makes to YouTube by adding latency to every stream lookup."""
+
+    def __init__(self, path, latency):
+        super().__init__(path)
+        self.latency = latency
+
+    def get_stream(self, video_id):
+        time.sleep(self.latency)
+        return super().get_stream(video_id)
+
+
+def video_id(n):
+    return f"bench{n:06d}"
+
+
+def seed_resolve_cache(cache, server, tracks, itag=STREAM_ITAG):
+    expire = int(time.time()) + 24 * 60 * 60
+    urls = []
+    for n in range(tracks):
+        vid = video_id(n)
+        stream = StreamInfo(f"{server.url}/stream/{vid}?expire={expire}", len(server.stream), itag)
+        cache.put_stream(vid, f"Bench Track {n + 1}", 180, stream)
+        urls.append(f"https://www.youtube.com/watch?v={vid}")
+    return urls
+
+
+def timed(func):
+    start = time.perf_counter()
+    result = func()
+    return result, time.perf_counter() - start
+
+
+def bench_discogs(server, workdir):
+    discogs.discogs_api_url = f"{server.url}/api/releases"
+    release = discogs.Discogs.__new__(discogs.Discogs)
+    release.cache = discogs.DiscogsCache(os.path.join(workdir, "discogs"))
+
+    def lookup():
+        release.lookup(f"{server.url}/release/{RELEASE_ID}-benchmark-album", RELEASE_ID)
+        return release
+
+    return timed(lookup)
+
+
+def bench_titles(release, workdir):
+    path = os.path.join(workdir, "titles.txt")
+    release.make_file(path)
+    tg = TitleGenerator(path, release.artist)
+    _, seconds = timed(tg.make_titles)
+    return path, seconds
+
+
+def run(args):
+    faults = Faults(
+        args.latency, args.bandwidth * 1024 if args.bandwidth else None, args.fail_rate, args.seed, args.max_streams
+    )
+    server = MediaServer(int(args.size_mb * 1024 * 1024), args.tracks, faults).start()
+    workdir = tempfile.mkdtemp(prefix="ytam-bench-")
+    try:
+        session.configure(max(session.DEFAULT_POOL_SIZE, args.jobs * (args.connections or 1)))
+        if args.max_rate is not None:
+            shaper.configure(shaper.parse_rate(args.max_rate))
+        release, discogs_s = bench_discogs(server, workdir)
+        titles, titles_s = bench_titles(release, workdir)
+
+        cache = SlowResolveCache(os.path.join(workdir, "resolve.db"), args.resolve_latency)
+        itag = OPUS_ITAG if args.format is not None and FORMATS[args.format].can_copy("opus") else STREAM_ITAG
+        urls = seed_resolve_cache(cache, server, args.tracks, itag)
+        outdir = os.path.join(workdir, "music") + os.sep
+        d = TimedDownloader(
+            list(enumerate(urls)),
+            args.tracks,
+            release.album,
+            outdir,
+            release.artist,
+            True,
+            titles,
+            release.image,
+            False,
+            None,
+            args.mp3,
+            args.jobs,
+            ArtCache(),
+            False,
+            args.connections,
+            cache,
+            args.stream,
+            prefetch=args.prefetch,
+            max_jobs=args.max_jobs,
+            output_format=args.format,
+        )
+        d.start = 0
+
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            _, download_s = timed(d.download)
+
+        moved = d.successful * len(server.stream)
+        return {
+            "config": vars(args),
+            "discogs_s": round(discogs_s, 4),
+            "titles_s": round(titles_s, 4),
+            "download": {
+                "wall_s": round(download_s, 4),
+                "tracks": args.tracks,
+                "successful": d.successful,
+                "failed": len(d.retry_urls),
+                "tracks_per_s": round(d.successful / download_s, 3) if download_s else 0.0,
+                "bytes": moved,
+                "mb_per_s": round(moved / (1024 * 1024) / download_s, 3) if download_s else 0.0,
+                "stages": {name: stage.as_dict() for name, stage in d.stages.items()},
+            },
+            "requests": dict(server.requests),
+        }
+    finally:
+        server.stop()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="Offline end-to-end benchmark for ytam")
+    parser.add_argument("--tracks", type=int, default=10, help="number of tracks in the fake album")
+    parser.add_argument("--size-mb", type=float, default=4.0, help="size of every fake stream in MB")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added before every response")
+    parser.add_argument("--bandwidth", type=int, help="per-connection bandwidth cap in KB/s")
+    parser.add_argument(
+        "--resolve-latency", type=float, default=0.0, help="seconds added to every stream lookup, as pytube would"
+    )
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="share of requests that fail with a 503")
+    parser.add_argument("--seed", type=int, default=0, help="seed for the injected failures")
+    parser.add_argument("--jobs", type=int, default=1)
+    parser.add_argument("--max-jobs", type=int, help="lets the number of tracks at a time grow up to this many")
+    parser.add_argument("--max-rate", help="caps the combined download speed, such as 2M")
+    parser.add_argument("--max-streams", type=int, help="answers more streams than this at a time with a 429")
+    parser.add_argument("--connections", type=int)
+    parser.add_argument("--prefetch", type=int, default=4, help="how many tracks ahead to resolve (0 turns it off)")
+    parser.add_argument("--mp3", action="store_true", help="also convert to mp3 (needs ffmpeg)")
+    parser.add_argument("--format", choices=sorted(FORMATS), help="convert to this format (needs ffmpeg unless mp4)")
+    parser.add_argument("--stream", action="store_true", help="with --mp3 or --format, pipe the streams into ffmpeg")
+    parser.add_argument("--output", help="also write the results to this file")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(sys.argv[1:] if argv is None else argv)
+    report = json.dumps(run(args), indent=2)
+    print(report)
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            f.write(report + "\n")
+
+
+if __name__ == "__main__":
+    main()
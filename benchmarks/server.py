@@ -0,0 +1,199 @@
+import re
+import sys
+import json
+import time
+import random
+import struct
+import threading
+from urllib.parse import urlparse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+WRITE_SIZE = 16 * 1024
+IMAGE = b"\xff\xd8\xff\xe0" + bytes(range(256)) * 64 + b"\xff\xd9"
+
+STREAM_PATH = re.compile(r"^/stream/([0-9A-Za-z_-]+)$")
+RELEASE_PATH = re.compile(r"^/release/(\d+)-.+$")
+API_PATH = re.compile(r"^/api/releases/(\d+)$")
+RANGE_HEADER = re.compile(r"^bytes=(\d+)-(\d*)$")
+
+
+def _box(kind, payload):
+    return struct.pack(">I", 8 + len(payload)) + kind + payload
+
+
+def make_stream(size):
+    """Builds an mp4 that mutagen can open and tag, padded with an mdat box to the requested size."""
+    mvhd = _box(b"mvhd", bytes(12) + struct.pack(">II", 1000, 180000) + bytes(80))
+    mdhd = _box(b"mdhd", bytes(12) + struct.pack(">II", 44100, 44100 * 180) + bytes(4))
+    hdlr = _box(b"hdlr", bytes(8) + b"soun" + bytes(13))
+    moov = _box(b"moov", mvhd + _box(b"trak", _box(b"mdia", mdhd + hdlr)))
+    head = _box(b"ftyp", b"M4A \x00\x00\x00\x00M4A mp42isom") + moov
+    return head + _box(b"mdat", bytes(max(0, size - len(head) - 8)))
+
+
+class Faults:
+    def __init__(self, latency=0.0, bandwidth=None, fail_rate=0.0, seed=0, max_streams=None):
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.fail_rate = fail_rate
+        # more stream requests than this at the same time are answered with a 429, the way YouTube throttles
+        self.max_streams = max_streams
+        self.streams = 0
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+
+    def should_fail(self):
+        with self.lock:
+            return self.random.random() < self.fail_rate
+
+    def open_stream(self):
+        with self.lock:
+            if self.max_streams is not None and self.streams >= self.max_streams:
+                return False
+            self.streams += 1
+            return True
+
+    def close_stream(self):
+        with self.lock:
+            self.streams -= 1
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        server = self.server
+        path = urlparse(self.path).path
+        server.count(path)
+        time.sleep(server.faults.latency)
+        if server.faults.should_fail():
+            self.respond(503, b"injected failure", "text/plain")
+            return
+
+        match = STREAM_PATH.match(path)
+        if match:
+            if not server.faults.open_stream():
+                self.respond(429, b"too many requests", "text/plain")
+                return
+            try:
+                self.respond_range(server.stream)
+            finally:
+                server.faults.close_stream()
+            return
+
+        if path.startswith("/image/"):
+            self.respond(200, IMAGE, "image/jpeg")
+            return
+
+        match = RELEASE_PATH.match(path)
+        if match:
+            if self.not_modified(f'"page-{match.group(1)}"'):
+                return
+            html = (
+                f'<html><head><meta property="og:image" content="{server.url}/image/{match.group(1)}.jpg"/>'
+                f"</head><body>{'<div></div>' * 2000}</body></html>"
+            )
+            self.respond(200, html.encode("utf8"), "text/html", {"ETag": f'"page-{match.group(1)}"'})
+            return
+
+        match = API_PATH.match(path)
+        if match:
+            if self.not_modified(f'"api-{match.group(1)}"'):
+                return
+            release = {
+                "title": "Benchmark Album",
+                "artists": [{"name": "Benchmark Artist (2)"}],
+                "tracklist": [{"title": f"Track {n + 1}"} for n in range(server.tracks)],
+            }
+            if server.api_images:
+                release["images"] = [{"type": "primary", "uri": f"{server.url}/image/{match.group(1)}.jpg"}]
+            headers = {
+                "ETag": f'"api-{match.group(1)}"',
+                "X-Discogs-Ratelimit": "25",
+                "X-Discogs-Ratelimit-Remaining": "24",
+            }
+            self.respond(200, json.dumps(release).encode("utf8"), "application/json", headers)
+            return
+
+        self.respond(404, b"not found", "text/plain")
+
+    def not_modified(self, etag):
+        if self.headers.get("If-None-Match") != etag:
+            return False
+        self.send_response(304)
+        self.send_header("ETag", etag)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+        return True
+
+    def respond(self, status, body, content_type, headers=None):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.write_throttled(body)
+
+    def respond_range(self, data):
+        match = RANGE_HEADER.match(self.headers.get("Range", ""))
+        if match is None:
+            self.respond(200, data, "audio/mp4")
+            return
+
+        start = int(match.group(1))
+        end = int(match.group(2)) if match.group(2) else len(data) - 1
+        end = min(end, len(data) - 1)
+        self.respond(206, data[start:end + 1], "audio/mp4", {"Content-Range": f"bytes {start}-{end}/{len(data)}"})
+
+    def write_throttled(self, body):
+        bandwidth = self.server.faults.bandwidth
+        for offset in range(0, len(body), WRITE_SIZE):
+            block = body[offset:offset + WRITE_SIZE]
+            self.wfile.write(block)
+            if bandwidth:
+                time.sleep(len(block) / bandwidth)
+
+
+class MediaServer(ThreadingHTTPServer):
+    """A local stand-in for the YouTube stream, thumbnail and Discogs release/API endpoints.
+
+    Every response can be slowed down by a fixed latency and a per-connection bandwidth cap, and a share of
+    requests can be made to fail with a 503 and streams over a concurrency cap with a 429, so that ytam can be
+    measured offline and repeatably.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, stream_size, tracks, faults=None, port=0, api_images=True):
+        super().__init__(("127.0.0.1", port), Handler)
+        self.stream = make_stream(stream_size)
+        self.tracks = tracks
+        self.api_images = api_images
+        self.faults = Faults() if faults is None else faults
+        self.url = f"http://127.0.0.1:{self.server_address[1]}"
+        self.requests = {}
+        self.requests_lock = threading.Lock()
+        self.thread = None
+
+    def handle_error(self, request, client_address):
+        # clients hang up halfway through a response on purpose, e.g. a page scan that already found its tag
+        if not isinstance(sys.exc_info()[1], (ConnectionResetError, BrokenPipeError)):
+            super().handle_error(request, client_address)
+
+    def count(self, path):
+        kind = path.split("/")[1] if "/" in path else path
+        with self.requests_lock:
+            self.requests[kind] = self.requests.get(kind, 0) + 1
+
+    def start(self):
+        self.thread = threading.Thread(target=self.serve_forever, name="bench-server", daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
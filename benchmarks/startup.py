@@ -0,0 +1,83 @@
+"""Startup-time benchmark for the ytam command line tool.
+
+Times `ytam --version` and `ytam --help` in fresh interpreters against a bare `python -c pass`, and checks that
+importing ytam.cmd leaves the heavy dependencies unloaded. Prints the results as JSON and exits with status 1 if
+a heavy module was imported or, with --max-ms, if a command takes longer than that on top of the interpreter.
+
+    python benchmarks/startup.py --runs 20 --max-ms 100
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import statistics
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# modules that only the code paths that download, tag or look things up should load
+HEAVY = ("pytube", "mutagen", "requests", "bs4", "asyncio", "pkg_resources")
+
+COMMANDS = {
+    "baseline": ["-c", "pass"],
+    "version": ["-m", "ytam.cmd", "--version"],
+    "help": ["-m", "ytam.cmd", "--help"],
+}
+
+
+def time_command(args, runs):
+    samples = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run(
+            [sys.executable] + args, cwd=ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True
+        )
+        samples.append((time.perf_counter() - start) * 1000)
+    return samples
+
+
+def loaded_heavy_modules():
+    script = f"import sys, ytam.cmd; print(' '.join(m for m in {HEAVY!r} if m in sys.modules))"
+    out = subprocess.run([sys.executable, "-c", script], cwd=ROOT, stdout=subprocess.PIPE, check=True).stdout
+    return out.decode().split()
+
+
+def run(args):
+    results = {}
+    for name, command in COMMANDS.items():
+        samples = time_command(command, args.runs)
+        results[name] = {"min_ms": round(min(samples), 1), "median_ms": round(statistics.median(samples), 1)}
+
+    baseline = results["baseline"]["median_ms"]
+    for name in ("version", "help"):
+        results[name]["over_baseline_ms"] = round(results[name]["median_ms"] - baseline, 1)
+
+    heavy = loaded_heavy_modules()
+    failures = [f"importing ytam.cmd loads {module}" for module in heavy]
+    if args.max_ms is not None:
+        failures += [
+            f"{name} takes {results[name]['over_baseline_ms']} ms over the interpreter, budget is {args.max_ms}"
+            for name in ("version", "help")
+            if results[name]["over_baseline_ms"] > args.max_ms
+        ]
+    return {"config": vars(args), "commands": results, "heavy_modules": heavy, "failures": failures}
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="Startup-time benchmark for the ytam command line tool")
+    parser.add_argument("--runs", type=int, default=10, help="how many times to run every command")
+    parser.add_argument(
+        "--max-ms", type=float, help="fails if --version or --help take longer than this on top of the interpreter"
+    )
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    report = run(parse_args(argv))
+    print(json.dumps(report, indent=2))
+    return 1 if len(report["failures"]) > 0 else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -13,7 +13,7 @@ setuptools.setup(
     long_description=long_description,
     long_description_content_type="text/markdown",
     url="https://github.com/jayathungek/ytam",
-    packages=find_packages(),
+    packages=find_packages(exclude=("tests",)),
     classifiers=[
         "Programming Language :: Python :: 3",
         "License :: OSI Approved :: MIT License",
@@ -31,6 +31,5 @@ setuptools.setup(
         "mutagen",
         "requests",
         "urllib3",
-        "python-ffmpeg",
     ],
 )
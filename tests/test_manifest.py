@@ -0,0 +1,75 @@
+import os
+import json
+
+from ytam.manifest import Manifest, open_manifest, MANIFEST_FILENAME, JOURNAL_SUFFIX
+
+
+def write_song(tmp_path, name, data=b"audio"):
+    path = tmp_path / name
+    path.write_bytes(data)
+    return str(path)
+
+
+def test_changes_go_to_the_journal(tmp_path):
+    manifest = Manifest(str(tmp_path))
+    manifest.record("aaaaaaaaaaa", "downloaded", write_song(tmp_path, "a.mp4"), title="A")
+
+    assert not (tmp_path / MANIFEST_FILENAME).exists()
+    lines = (tmp_path / (MANIFEST_FILENAME + JOURNAL_SUFFIX)).read_text().splitlines()
+    assert [json.loads(line)["video_id"] for line in lines] == ["aaaaaaaaaaa"]
+
+
+def test_journal_is_replayed_and_compacted(tmp_path):
+    manifest = Manifest(str(tmp_path))
+    manifest.record("aaaaaaaaaaa", "downloaded", write_song(tmp_path, "a.mp4"), title="A")
+    manifest.record("bbbbbbbbbbb", "downloaded", write_song(tmp_path, "b.mp4"), title="B")
+    manifest.record("aaaaaaaaaaa", "converted", write_song(tmp_path, "a.mp3"))
+    manifest.forget("bbbbbbbbbbb")
+
+    # a run that was cut short never compacts; the next one replays what it left
+    reread = Manifest(str(tmp_path))
+    assert reread.entries.keys() == {"aaaaaaaaaaa"}
+    entry = reread.get("aaaaaaaaaaa")
+    assert entry["stages"] == ["downloaded", "converted"]
+    assert entry["path"] == str(tmp_path / "a.mp3")
+    assert entry["title"] == "A"
+    assert not (tmp_path / (MANIFEST_FILENAME + JOURNAL_SUFFIX)).exists()
+    with open(tmp_path / MANIFEST_FILENAME) as f:
+        assert json.load(f) == reread.entries
+
+
+def test_half_written_line_is_skipped(tmp_path):
+    manifest = Manifest(str(tmp_path))
+    manifest.record("aaaaaaaaaaa", "downloaded", write_song(tmp_path, "a.mp4"))
+    with open(tmp_path / (MANIFEST_FILENAME + JOURNAL_SUFFIX), "a") as f:
+        f.write('{"video_id": "bbbbbbbbbbb", "ent')
+
+    assert Manifest(str(tmp_path)).entries.keys() == {"aaaaaaaaaaa"}
+
+
+def test_compact_then_more_changes(tmp_path):
+    manifest = Manifest(str(tmp_path))
+    manifest.record("aaaaaaaaaaa", "downloaded", write_song(tmp_path, "a.mp4"))
+    manifest.compact()
+    manifest.record("bbbbbbbbbbb", "downloaded", write_song(tmp_path, "b.mp4"))
+
+    assert Manifest(str(tmp_path)).entries.keys() == {"aaaaaaaaaaa", "bbbbbbbbbbb"}
+
+
+def test_verify_forgets_changed_files(tmp_path):
+    manifest = Manifest(str(tmp_path))
+    path = write_song(tmp_path, "a.mp4")
+    manifest.record("aaaaaaaaaaa", "downloaded", path)
+    assert manifest.verify("aaaaaaaaaaa") is not None
+
+    with open(path, "ab") as f:
+        f.write(b"more")
+    assert manifest.verify("aaaaaaaaaaa") is None
+    assert Manifest(str(tmp_path)).get("aaaaaaaaaaa") is None
+
+
+def test_open_manifest_is_shared(tmp_path):
+    outdir = str(tmp_path)
+    manifest = open_manifest(outdir)
+    assert open_manifest(os.path.join(outdir, ".")) is manifest
+    assert open_manifest(str(tmp_path / "other")) is not manifest
@@ -0,0 +1,28 @@
+from ytam.proxypool import parse_proxies
+
+
+def test_one_member_per_address():
+    members = parse_proxies("http-1.1.1.1:80 https-1.1.1.1:80 http-2.2.2.2:80 https-2.2.2.2:80")
+    assert members == [
+        {"http": "1.1.1.1:80", "https": "1.1.1.1:80"},
+        {"http": "2.2.2.2:80", "https": "2.2.2.2:80"},
+    ]
+
+
+def test_single_protocol_addresses():
+    assert parse_proxies("https-1.1.1.1:80 https-2.2.2.2:80") == [{"https": "1.1.1.1:80"}, {"https": "2.2.2.2:80"}]
+
+
+def test_split_protocols_stay_together():
+    # each address only covers one protocol, so taken apart they would send the other one direct
+    assert parse_proxies("http-1.1.1.1:80 https-2.2.2.2:80") == [{"http": "1.1.1.1:80", "https": "2.2.2.2:80"}]
+
+
+def test_uneven_protocols_stay_together():
+    members = parse_proxies("http-1.1.1.1:80 https-1.1.1.1:80 https-2.2.2.2:80")
+    assert members == [{"http": "1.1.1.1:80", "https": "2.2.2.2:80"}]
+
+
+def test_extra_spaces_and_address_with_dashes():
+    members = parse_proxies(" http-proxy-a.example:3128  https-proxy-a.example:3128 ")
+    assert members == [{"http": "proxy-a.example:3128", "https": "proxy-a.example:3128"}]
@@ -0,0 +1,79 @@
+import pytest
+
+from ytam import error
+from ytam.title import TitleGenerator
+
+
+def read(tmp_path, name, text, no_album=False):
+    path = tmp_path / name
+    path.write_text(text)
+    generator = TitleGenerator(str(path), "Artist", no_album=no_album)
+    generator.make_titles()
+    return [(t.title, t.artist, t.album, t.image_path) for t in generator.get_titles()]
+
+
+def bad_line(tmp_path, name, text, no_album=False):
+    with pytest.raises(error.BadTitleFormatError) as info:
+        read(tmp_path, name, text, no_album)
+    return info.value.message
+
+
+def test_csv(tmp_path):
+    # an empty line keeps the song's own title, as in the <@> format
+    titles = read(tmp_path, "t.csv", 'One,Someone\n\n"Two, Part 2",B\n')
+    assert titles == [("One", "Someone", None, None), ("", "Artist", None, None), ("Two, Part 2", "B", None, None)]
+
+
+def test_csv_header(tmp_path):
+    text = "title,artist,album,image\nOne,A,Album,one.jpg\nTwo,B,Album,\n"
+    titles = read(tmp_path, "t.csv", text, no_album=True)
+    assert titles == [("One", "A", "Album", "one.jpg"), ("Two", "B", "Album", None)]
+
+
+def test_csv_single_column_title_is_a_song(tmp_path):
+    titles = read(tmp_path, "t.csv", "Title\nOther\n")
+    assert titles == [("Title", "Artist", None, None), ("Other", "Artist", None, None)]
+
+
+def test_csv_bad_line_after_multiline_field(tmp_path):
+    # the quoted field spans lines 1 and 2, so the bad row is on line 3
+    message = bad_line(tmp_path, "t.csv", '"One\nstill one",A,Album\nTwo,B\n', no_album=True)
+    assert "line 3 " in message
+
+
+def test_csv_too_many_fields(tmp_path):
+    assert "line 2 " in bad_line(tmp_path, "t.csv", "One,A\nTwo,B,Album\n")
+
+
+def test_json_lines(tmp_path):
+    text = '{"title": "One", "artist": "A"}\n\n{"title": "Two"}\n'
+    titles = read(tmp_path, "t.jsonl", text)
+    assert titles == [("One", "A", None, None), ("", "Artist", None, None), ("Two", "Artist", None, None)]
+
+
+def test_json_lines_bad_json(tmp_path):
+    message = bad_line(tmp_path, "t.ndjson", '{"title": "One"}\n{"title": "Two"\n')
+    assert "line 2 " in message and "not valid JSON" in message
+
+
+def test_json_lines_unknown_field(tmp_path):
+    message = bad_line(tmp_path, "t.jsonl", '{"title": "One"}\n{"title": "Two", "year": 1999}\n')
+    assert "line 2 " in message and "'year'" in message
+
+
+def test_json_lines_not_an_object(tmp_path):
+    assert "not a JSON object" in bad_line(tmp_path, "t.jsonl", '["One", "A"]\n')
+
+
+def test_json_array(tmp_path):
+    text = '[\n  {"title": "One", "artist": "A", "album": "X"},\n  {"title": "Two", "artist": "B", "album": "X"}\n]\n'
+    assert read(tmp_path, "t.json", text, no_album=True) == [("One", "A", "X", None), ("Two", "B", "X", None)]
+
+
+def test_json_array_bad_entry_line(tmp_path):
+    text = '[\n  {"title": "One", "artist": "A", "album": "X"},\n\n  {"title": "Two"}\n]\n'
+    assert "line 4 " in bad_line(tmp_path, "t.json", text, no_album=True)
+
+
+def test_json_file_of_json_lines(tmp_path):
+    assert read(tmp_path, "t.json", '{"title": "One"}\n') == [("One", "Artist", None, None)]
@@ -0,0 +1,15 @@
+import sys
+
+# the public API is imported on first use, so that importing ytam.cmd (and with it every run of the command line
+# tool) doesn't load asyncio, pytube, mutagen and requests before it needs them
+_API = ("download_playlist", "TrackProgress", "TrackCompleted", "TrackFailed")
+
+if sys.version_info < (3, 7):
+    from ytam.api import download_playlist, TrackProgress, TrackCompleted, TrackFailed
+else:
+    def __getattr__(name):
+        if name in _API:
+            import ytam.api
+
+            return getattr(ytam.api, name)
+        raise AttributeError(f"module 'ytam' has no attribute {name!r}")
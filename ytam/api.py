@@ -0,0 +1,261 @@
+import os
+import time
+import asyncio
+import threading
+
+try:
+    import error
+    import retry
+    from ytam import Downloader, Failure, resolve_playlist
+    from console import TrackConsole
+    from progress import INTERVAL
+    from prefetch import DEFAULT_DEPTH
+except ModuleNotFoundError:
+    import ytam.error as error
+    import ytam.retry as retry
+    from ytam.ytam import Downloader, Failure, resolve_playlist
+    from ytam.console import TrackConsole
+    from ytam.progress import INTERVAL
+    from ytam.prefetch import DEFAULT_DEPTH
+
+
+class Event:
+    def __init__(self, song, title):
+        self.song = song
+        self.title = title
+
+    def __repr__(self):
+        fields = ", ".join(f"{name}={value!r}" for name, value in vars(self).items())
+        return f"{type(self).__name__}({fields})"
+
+
+class TrackProgress(Event):
+    """A track is being downloaded or converted. done and total are in bytes; percent is None until known."""
+
+    def __init__(self, song, title, stage, done, total, percent):
+        super().__init__(song, title)
+        self.stage = stage
+        self.done = done
+        self.total = total
+        self.percent = percent
+
+
+class TrackCompleted(Event):
+    """A track is on disk at path. stages lists what was done to it; a track that could not be tagged or
+    converted still completes, without that stage.
+    """
+
+    def __init__(self, song, title, url, path, stages):
+        super().__init__(song, title)
+        self.url = url
+        self.path = path
+        self.stages = stages
+
+
+class TrackFailed(Event):
+    """A track could not be downloaded. kind is retry.TRANSIENT or retry.PERMANENT."""
+
+    def __init__(self, song, title, url, kind, reason, error):
+        super().__init__(song, title)
+        self.url = url
+        self.kind = kind
+        self.reason = reason
+        self.error = error
+
+
+class _TrackState:
+    __slots__ = ("song", "title", "size", "done", "stage", "percent", "emitted")
+
+    def __init__(self, song, title, size):
+        self.song = song
+        self.title = title
+        self.size = size
+        self.done = 0
+        self.stage = "Downloading"
+        self.percent = None
+        self.emitted = 0.0
+
+
+class EventProgress:
+    """Takes the place of ProgressRenderer for the API: instead of drawing, it turns the progress of every track
+    into TrackProgress events, at most one per track every interval seconds.
+    """
+
+    def __init__(self, emit, interval=INTERVAL):
+        self.emit = emit
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.tracks = {}
+
+    def start(self):
+        return self
+
+    def stop(self):
+        pass
+
+    def println(self, text):
+        pass
+
+    def _update(self, key, force=False, **changes):
+        with self.lock:
+            state = self.tracks.get(key)
+            if state is None:
+                return
+            for name, value in changes.items():
+                setattr(state, name, value)
+            now = time.monotonic()
+            if not force and now - state.emitted < self.interval:
+                return
+            state.emitted = now
+            event = TrackProgress(state.song, state.title, state.stage, state.done, state.size, state.percent)
+        self.emit(event)
+
+    def start_track(self, key, song, title, size):
+        with self.lock:
+            if key in self.tracks:
+                return
+            self.tracks[key] = _TrackState(song, title, size)
+        self._update(key, force=True)
+
+    def set_bytes(self, key, done):
+        state = self.tracks.get(key)
+        self._update(key, force=state is not None and done == state.size, done=done)
+
+    def set_stage(self, key, stage, percent=None):
+        state = self.tracks.get(key)
+        self._update(key, force=state is not None and state.stage != stage, stage=stage, percent=percent)
+
+    def finish_track(self, key):
+        with self.lock:
+            self.tracks.pop(key, None)
+
+
+def track_event(track):
+    if track.path is not None:
+        return TrackCompleted(track.song, track.title, track.url, track.path, list(track.stages))
+    failure = Failure(track, retry.classify(track.error))
+    return TrackFailed(track.song, track.title, track.url, failure.kind, failure.reason, track.error)
+
+
+class _Raise:
+    def __init__(self, error):
+        self.error = error
+
+
+async def download_playlist(
+        url,
+        outdir=f"music{os.sep}",
+        album=None,
+        artist=None,
+        titles=None,
+        image=None,
+        start=None,
+        end=None,
+        mp3=False,
+        stream=False,
+        jobs=1,
+        connections=None,
+        proxies=None,
+        proxy_pool=None,
+        art_cache=None,
+        resolve_cache=None,
+        resume=True,
+        keep_images=False,
+        metrics=None,
+        library=None,
+        prefetch=DEFAULT_DEPTH,
+        max_jobs=None,
+        output_format=None,
+        progress_interval=INTERVAL,
+):
+    """Downloads a playlist and yields a TrackProgress, TrackCompleted or TrackFailed event for each of its tracks
+    as things happen, in the order in which they happen:
+
+        async for event in ytam.download_playlist(url, outdir="music/", mp3=True):
+            ...
+
+    The options mean what the command line options of the same name do; start and end count from 1. The
+    download itself runs on threads of its own, so the event loop is never blocked and several playlists can be
+    downloaded from the same loop at once. art_cache (an ArtCache) and resolve_cache (a ResolveCache) can be
+    shared between them, and so can metrics (a Metrics) that records stage timings and library (a Library) that
+    copies songs another playlist already downloaded instead of downloading them again. Nothing is printed. Errors
+    that stop the whole playlist, such as a bad URL or index, are raised from the iteration. Leaving the loop
+    early cancels the download: tracks already in a stage finish it, and no new ones are started.
+    """
+    loop = asyncio.get_event_loop()
+    events = asyncio.Queue()
+    finished = object()
+    cancelled = threading.Event()
+    downloaders = []
+
+    def emit(event):
+        try:
+            loop.call_soon_threadsafe(events.put_nowait, event)
+        except RuntimeError:
+            # the loop was closed under a download that is still winding down; nobody is listening any more
+            pass
+
+    def work():
+        try:
+            playlist_title, urls, _ = resolve_playlist(url, resolve_cache, max(start or 0, end or 0))
+            first = 0 if start is None else start - 1
+            last = len(urls) if end is None else end
+            if first >= len(urls):
+                raise error.InvalidPlaylistIndexError(first, playlist_title)
+            if last < first:
+                raise error.IndicesOutOfOrderError()
+
+            d = Downloader(
+                list(enumerate(urls[first:last])),
+                len(urls),
+                playlist_title if album is None else album,
+                outdir,
+                "Unknown" if artist is None else artist,
+                album is not None,
+                titles,
+                image,
+                keep_images,
+                proxies,
+                mp3,
+                jobs,
+                art_cache,
+                resume,
+                connections,
+                resolve_cache,
+                stream,
+                proxy_pool,
+                metrics,
+                library,
+                prefetch,
+                max_jobs,
+                output_format,
+            )
+            d.start = first
+            downloaders.append(d)
+            if cancelled.is_set():
+                return
+
+            tracks = d.prepare()
+            d.progress = EventProgress(emit, progress_interval)
+            d.console = TrackConsole((track.key for track in tracks), out=lambda text: None)
+            d.on_track_done = lambda track: emit(track_event(track))
+            d.run(tracks)
+            d.collect(tracks)
+        except BaseException as e:
+            emit(_Raise(e))
+        finally:
+            emit(finished)
+
+    threading.Thread(target=work, name="ytam-api", daemon=True).start()
+    try:
+        while True:
+            event = await events.get()
+            if event is finished:
+                return
+            if isinstance(event, _Raise):
+                raise event.error
+            yield event
+    finally:
+        cancelled.set()
+        for d in downloaders:
+            d.cancel()
@@ -0,0 +1,138 @@
+import os
+import json
+import hashlib
+import threading
+
+try:
+    import error
+    import session
+    import shaper
+except ModuleNotFoundError:
+    import ytam.error as error
+    import ytam.session as session
+    import ytam.shaper as shaper
+
+INDEX_FILENAME = "index.json"
+
+
+def is_png(data):
+    return data[:8] == b"\x89PNG\r\n\x1a\n"
+
+
+class ArtCache:
+    """Keeps album art in memory so that a cover shared by many tracks is fetched and read only once per run.
+
+    Images are looked up by source (URL or local path) and stored by the sha1 of their content, so two URLs
+    that serve the same picture share one copy. If a store directory is given, downloaded images and the
+    URL -> hash index are also written there and reused by later runs.
+    """
+
+    def __init__(self, store=None):
+        self.store = store
+        self.lock = threading.Lock()
+        self.source_locks = {}
+        self.sources = {}
+        self.images = {}
+        self.failed = set()
+        self.index = {}
+
+        if self.store is not None:
+            os.makedirs(self.store, exist_ok=True)
+            try:
+                with open(os.path.join(self.store, INDEX_FILENAME), "r") as f:
+                    self.index = json.load(f)
+            except (OSError, ValueError):
+                self.index = {}
+
+    def _source_lock(self, source):
+        with self.lock:
+            if source not in self.source_locks:
+                self.source_locks[source] = threading.Lock()
+            return self.source_locks[source]
+
+    def _stored_path(self, digest):
+        return os.path.join(self.store, f"{digest}.img")
+
+    def _load_stored(self, source):
+        digest = self.index.get(source)
+        if digest is None:
+            return None
+        try:
+            with open(self._stored_path(digest), "rb") as f:
+                data = f.read()
+        except OSError:
+            return None
+        return data if hashlib.sha1(data).hexdigest() == digest else None
+
+    def _save_stored(self, source, digest, data):
+        path = self._stored_path(digest)
+        if not os.path.exists(path):
+            with open(path, "wb") as f:
+                f.write(data)
+        with self.lock:
+            self.index[source] = digest
+            with open(os.path.join(self.store, INDEX_FILENAME), "w") as f:
+                json.dump(self.index, f)
+
+    def _fetch(self, url):
+        import requests
+
+        try:
+            response = session.get_client().get(url, stream=True)
+            try:
+                chunks = []
+                for chunk in response.iter_content(chunk_size=shaper.QUANTUM):
+                    shaper.throttle(len(chunk))
+                    chunks.append(chunk)
+            finally:
+                response.close()
+        except requests.RequestException:
+            raise error.ImageDownloadError(url)
+        content = b"".join(chunks)
+        if len(content) == 0:
+            raise error.ImageDownloadError(url)
+        return content
+
+    def _add(self, source, data):
+        digest = hashlib.sha1(data).hexdigest()
+        with self.lock:
+            data = self.images.setdefault(digest, data)
+            self.sources[source] = digest
+        return digest, data
+
+    def get(self, source, is_remote):
+        """Returns (content hash, image bytes) for a URL or local path. Raises error.ImageDownloadError if a
+        URL cannot be downloaded and OSError if a local file cannot be read."""
+        with self._source_lock(source):
+            digest = self.sources.get(source)
+            if digest is not None:
+                return digest, self.images[digest]
+            if source in self.failed:
+                raise error.ImageDownloadError(source)
+
+            if not is_remote:
+                with open(source, "rb") as f:
+                    return self._add(source, f.read())
+
+            data = self._load_stored(source) if self.store is not None else None
+            if data is None:
+                try:
+                    data = self._fetch(source)
+                except error.ImageDownloadError:
+                    self.failed.add(source)
+                    raise
+                digest, data = self._add(source, data)
+                if self.store is not None:
+                    self._save_stored(source, digest, data)
+                return digest, data
+
+            return self._add(source, data)
+
+    def write(self, digest, outdir):
+        # writes a cached image to outdir once, for when the downloaded art should be kept alongside the songs
+        ext = "png" if is_png(self.images[digest]) else "jpg"
+        path = os.path.join(outdir, f"album_art_{digest[:12]}.{ext}")
+        if not os.path.exists(path):
+            with open(path, "wb") as f:
+                f.write(self.images[digest])
+        return path
@@ -0,0 +1,85 @@
+import shlex
+
+try:
+    from console import TrackConsole
+    from progress import ProgressRenderer
+except ImportError:
+    from ytam.console import TrackConsole
+    from ytam.progress import ProgressRenderer
+
+
+class Job:
+    """One playlist to download: the options given for it (on the command line, or on line `line` of a jobs file)
+    and what they resolve to.
+    """
+
+    def __init__(self, line, args):
+        self.line = line
+        self.args = args
+        self.title = None if args is None else args.url
+        self.urls = None
+        self.playlist_id = None
+        self.start = None
+        self.end = None
+        self.directory = None
+        self.album = None
+        self.artist = None
+        self.is_album = None
+        self.image = None
+        self.titles = None
+        self.downloader = None
+        self.error = None
+        self.tracks = []
+
+
+def read_jobs(path, parser):
+    # one playlist per line, followed by its own options: URL [-A album] [-a artist] [-t titles] [-g discogs] ...
+    # Blank lines and lines starting with # are skipped
+    jobs = []
+    with open(path, "r") as f:
+        for n, line in enumerate(f, start=1):
+            line = line.strip()
+            if line == "" or line.startswith("#"):
+                continue
+            try:
+                args = parser.parse_args(shlex.split(line))
+            except SystemExit:
+                raise ValueError(f"line {n} of {path} is not a valid job: {line}")
+            jobs.append(Job(n, args))
+    return jobs
+
+
+class Batch:
+    """Downloads several playlists through one pipeline, so that the songs of the next playlist start downloading
+    as soon as a worker is free instead of once the last playlist is done.
+
+    Every job keeps its own Downloader, which holds its album, artist, titles and download directory. The workers,
+    progress display, console and whatever the Downloaders were built with (HTTP session, art cache, resolve cache,
+    proxy pool) are shared.
+    """
+
+    def __init__(self, jobs):
+        self.jobs = jobs
+
+    def run(self, header):
+        # header(job) is printed before the first song of every job
+        tracks = []
+        for n, job in enumerate(self.jobs):
+            # keeps the keys of tracks from different playlists apart in the shared progress display and console
+            job.downloader.job = n
+            job.tracks = job.downloader.prepare()
+            tracks += job.tracks
+        if len(tracks) == 0:
+            return
+
+        progress = ProgressRenderer(len(tracks))
+        console = TrackConsole((track.key for track in tracks), out=progress.println)
+        for job in self.jobs:
+            job.downloader.progress = progress
+            job.downloader.console = console
+            if len(job.tracks) > 0:
+                job.downloader.log(job.tracks[0], header(job))
+
+        self.jobs[0].downloader.run(tracks)
+        for job in self.jobs:
+            job.downloader.collect(job.tracks)
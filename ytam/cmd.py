@@ -1,23 +1,43 @@
 import os
 import sys
+import json
+import time
+import signal
+import tempfile
 import platform
+import importlib
 
 import argparse
 import colorama
-from pytube import Playlist
 
 try:
-    import version
     import error
     import font
-    from ytam import Downloader
-    from discogs import Discogs
+    import session
+    from artcache import ArtCache
+    from proxypool import ProxyPool, parse_proxies, DEFAULT_STREAMS
+    from batch import Job, Batch, read_jobs
+    from metrics import Metrics
+    from library import Library
+    from prefetch import DEFAULT_DEPTH
+    from formats import FORMATS, DEFAULT_FORMAT
+    import resolvecache
+    import retry
+    import shaper
 except ModuleNotFoundError:
-    import ytam.version as version
     import ytam.error as error
     import ytam.font as font
-    from ytam.ytam import Downloader
-    from ytam.discogs import Discogs
+    import ytam.session as session
+    from ytam.artcache import ArtCache
+    from ytam.proxypool import ProxyPool, parse_proxies, DEFAULT_STREAMS
+    from ytam.batch import Job, Batch, read_jobs
+    from ytam.metrics import Metrics
+    from ytam.library import Library
+    from ytam.prefetch import DEFAULT_DEPTH
+    from ytam.formats import FORMATS, DEFAULT_FORMAT
+    import ytam.resolvecache as resolvecache
+    import ytam.retry as retry
+    import ytam.shaper as shaper
 
 
 SEP = "\\" if platform.system() == "Windows" else "/"
@@ -25,6 +45,22 @@ full_path = os.path.realpath(__file__).split(SEP)
 BASE = f"{SEP.join(full_path[:-1])}"
 DEFAULT_TITLES = f"{BASE}{SEP}metadata{SEP}title.txt"
 
+# exit statuses, so that scripts can tell a finished run from one that is worth running again
+EXIT_OK = 0
+EXIT_ERROR = 1
+EXIT_FAILED = 3
+EXIT_INCOMPLETE = 4
+
+
+def load(name):
+    # pytube, mutagen and requests take most of ytam's startup time, so the modules that need them are only
+    # imported by the code paths that use them instead of at the top of this file
+    return importlib.import_module(f"{__package__}.{name}" if __package__ else name)
+
+
+def resolve_playlist(url, resolve_cache, needed=0):
+    return load("ytam").resolve_playlist(url, resolve_cache, needed)
+
 
 def check_positive(value):
     ivalue = int(value)
@@ -33,6 +69,32 @@ def check_positive(value):
     return ivalue
 
 
+def check_non_negative(value):
+    ivalue = int(value)
+    if ivalue < 0:
+        raise argparse.ArgumentTypeError(f"{value} is an invalid non-negative int value")
+    return ivalue
+
+
+def check_rate(value):
+    try:
+        return shaper.parse_rate(value)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
+
+
+def configure_shaper(max_rate, rate_file):
+    # one bucket for every transfer of the run. The control file, if any, can change its rate at any time, and is
+    # read again straight away on SIGHUP
+    if max_rate is None and rate_file is None:
+        return
+    bucket = shaper.configure(max_rate)
+    if rate_file is not None:
+        control = shaper.ControlFile(rate_file, bucket).start()
+        if hasattr(signal, "SIGHUP"):
+            signal.signal(signal.SIGHUP, lambda signum, frame: control.check(force=True))
+
+
 def is_affirmative(string):
     string = string.strip().lower()
     string = string.split(" ")[0]
@@ -41,12 +103,201 @@ def is_affirmative(string):
     return string in truthy
 
 
-def parse_args(args):
-    parser = argparse.ArgumentParser()
+def configure_session(jobs, connections, pool_size, timeout, proxies):
+    if pool_size is None:
+        pool_size = max(session.DEFAULT_POOL_SIZE, jobs * (connections or 1))
+    session.configure(pool_size, timeout, proxies)
+
+
+def exit_status(failures):
+    if len(failures) == 0:
+        return EXIT_OK
+    if any(failure.kind == retry.TRANSIENT for failure in failures):
+        return EXIT_INCOMPLETE
+    return EXIT_FAILED
+
+
+def write_status(path, status, **info):
+    if path is None:
+        return
+    names = {EXIT_OK: "ok", EXIT_ERROR: "error", EXIT_FAILED: "failed", EXIT_INCOMPLETE: "incomplete"}
+    tmp = f"{path}.tmp"
+    with open(tmp, "w") as f:
+        json.dump(dict(status=names[status], exit_code=status, **info), f, indent=2)
+    os.replace(tmp, path)
+
+
+def close_metrics(metrics):
+    if metrics is not None:
+        metrics.summary()
+        metrics.close()
+
+
+def resolve_job(job, resolve_cache, titles_path=DEFAULT_TITLES, metrics=None):
+    args = job.args
+    started = time.monotonic()
+    needed = max(args.start or 0, args.end or 0)
+    job.title, job.urls, job.playlist_id = resolve_playlist(args.url, resolve_cache, needed)
+    if metrics is not None:
+        metrics.event("playlist", time.monotonic() - started, url=args.url, tracks=len(job.urls))
+    job.start = 0 if args.start is None else args.start - 1
+    job.end = len(job.urls) if args.end is None else args.end
+    job.directory = f"music{SEP}" if args.directory is None else args.directory
+
+    if args.discogs is not None:
+        started = time.monotonic()
+        d = load("discogs").Discogs(args.discogs)
+        d.make_file(titles_path)
+        if metrics is not None:
+            metrics.event("discogs", time.monotonic() - started, url=args.discogs)
+        if (job.end - job.start) != d.num_tracks:
+            raise error.TracknumberMismatchError(job.title, d.album)
+        job.is_album = True
+        job.album = d.album
+        job.artist = d.artist
+        job.image = d.image
+        job.titles = titles_path
+
+    else:
+        job.album = job.title if args.album is None else args.album
+        job.artist = "Unknown" if args.artist is None else args.artist
+        job.is_album = False if args.album is None else True
+        job.image = args.image
+        job.titles = args.titles
+    return job
+
+
+def check_indices(job):
+    if job.start >= len(job.urls):
+        raise error.InvalidPlaylistIndexError(job.start, job.title)
+    if job.end < job.start:
+        raise error.IndicesOutOfOrderError()
+
+
+def make_downloader(job, shared):
+    d = load("ytam").Downloader(
+        list(enumerate(job.urls[job.start:job.end])),
+        len(job.urls),
+        job.album,
+        job.directory,
+        job.artist,
+        job.is_album,
+        job.titles,
+        job.image,
+        **shared,
+    )
+    d.start = job.start
+    return d
+
+
+def playlist_header(job):
+    downloading_message = f"Downloading songs {font.apply('gb', job.start+1)} - {font.apply('gb', job.end)} from " \
+                          f"playlist {font.apply('gb', job.title)}"
+    text_len = (
+        len("Downloading songs ")
+        + len(str(job.start))
+        + len(" - ")
+        + len(str(job.end))
+        + len(" from playlist ")
+        + len(job.title)
+    )
+    return downloading_message, text_len
+
+
+def run_batch(path, shared, retries, status_file):
+    resolve_cache = shared["resolve_cache"]
+    proxy_pool = shared["proxy_pool"]
+    try:
+        jobs = read_jobs(path, job_parser())
+    except (OSError, ValueError) as e:
+        print(f"Error: {e}")
+        write_status(status_file, EXIT_ERROR, message=str(e))
+        return EXIT_ERROR
+
+    ready = []
+    with tempfile.TemporaryDirectory(prefix="ytam-batch-") as tmp:
+        for job in jobs:
+            try:
+                # every job gets its own titles file, since they are all read once the batch starts
+                resolve_job(job, resolve_cache, os.path.join(tmp, f"titles-{job.line}.txt"), shared["metrics"])
+                check_indices(job)
+                job.downloader = make_downloader(job, shared)
+                ready.append(job)
+            except Exception as e:
+                job.error = e
+                message = e.message if isinstance(e, error.Error) else str(e)
+                print(f"Error: line {job.line} ({job.args.url}): {message}")
+
+        def header(job):
+            downloading_message, text_len = playlist_header(job)
+            return f"{downloading_message} \n{font.apply('gb', '─'*text_len)}"
+
+        attempt = 0
+        pending = ready
+        while len(pending) > 0:
+            Batch(pending).run(header)
+            pending = [job for job in pending if len(job.downloader.retry_urls) > 0]
+            for job in pending:
+                if resolve_cache is not None:
+                    resolve_cache.invalidate_playlist(job.playlist_id)
+            if len(pending) == 0 or retries is None or attempt >= retries:
+                break
+
+            delay = retry.backoff(attempt)
+            attempt += 1
+            for job in pending:
+                job.downloader.set_retries()
+            count = sum(len(job.downloader.urls) for job in pending)
+            message = f"Retrying {count} failed downloads in {delay:.1f}s (attempt {attempt}/{retries})."
+            print(message)
+            print(f"{font.apply('gb', '─'*len(message))}")
+            time.sleep(delay)
+
+    # one line per playlist, in the order of the jobs file
+    statuses = []
+    summary = []
+    for job in jobs:
+        if job.error is not None:
+            kind = retry.PERMANENT if isinstance(job.error, error.Error) else retry.classify(job.error)
+            statuses.append(EXIT_FAILED if kind == retry.PERMANENT else EXIT_INCOMPLETE)
+            message = job.error.message if isinstance(job.error, error.Error) else str(job.error)
+            print(f"{font.apply('gb', job.title)} - {font.apply('bf', '[Failed - ' + message + ']')}")
+            summary.append({"line": job.line, "url": job.args.url, "error": message})
+            continue
+
+        d = job.downloader
+        failures = [d.failures[song] for song in sorted(d.failures)]
+        statuses.append(exit_status(failures))
+        total = job.end - job.start
+        failed = f" - {font.apply('fb', str(len(failures)) + ' failed')}" if len(failures) > 0 else ""
+        print(f"{font.apply('gb', job.title)} - {d.successful}/{total} downloaded successfully{failed}")
+        summary.append({
+            "line": job.line,
+            "url": job.args.url,
+            "title": job.title,
+            "total": total,
+            "successful": d.successful,
+            "failures": [failure.as_dict() for failure in failures],
+        })
+    print()
+
+    if proxy_pool is not None:
+        for line in proxy_pool.summary():
+            print(f"  {line}")
+        print()
+
+    status = max(statuses) if len(statuses) > 0 else EXIT_OK
+    write_status(status_file, status, retries=attempt, jobs=summary)
+    return status
+
+
+def add_job_arguments(parser, url_required=True):
+    # the options that belong to one playlist. They are given on the command line, or per line of a --batch file
     parser.add_argument(
         "url",
         metavar="URL",
         type=str,
+        nargs=None if url_required else "?",
         help="the target URL of the playlist to download",
     )
     parser.add_argument(
@@ -55,7 +306,9 @@ def parse_args(args):
         help="a plain text file containing the desired titles and artists of the songs in the playlist, each on a new "
              "line. Format: title<@>artist. Note: if the --album flag is not set, each entry in this file is treated "
              "as a single with its own title, artist, album and cover art. In this case, title, artist and album are "
-             "mandatory and cover art is optional. Format: title<@>artist<@>album[<@>local path or url to image]",
+             "mandatory and cover art is optional. Format: title<@>artist<@>album[<@>local path or url to image]. "
+             "A file ending in .csv holds the same fields as CSV, one ending in .jsonl one JSON object per line with "
+             "the keys title, artist, album and image, and one ending in .json an array of such objects",
     )
     parser.add_argument(
         "-d",
@@ -98,12 +351,38 @@ def parse_args(args):
         type=str,
         help="the path to the image to be used as the album cover. Only works when -A flag is set",
     )
+
+
+def job_parser():
+    parser = argparse.ArgumentParser(prog="ytam --batch", add_help=False)
+    add_job_arguments(parser)
+    return parser
+
+
+def parse_args(args):
+    parser = argparse.ArgumentParser()
+    add_job_arguments(parser, url_required=False)
+    parser.add_argument(
+        "-b",
+        "--batch",
+        type=str,
+        help="a plain text file of playlists to download in one go instead of URL, each on a new line followed by "
+             "its own options (-t, -d, -g, -s, -e, -A, -a, -i). All other options apply to every playlist. Songs "
+             "from all playlists share the same download workers and caches",
+    )
     parser.add_argument(
         "-p",
         "--proxy",
         type=str,
         help="list of proxies to use. Must be enclosed in string quotes with a space separating each proxy. "
-             "Proxy format: <protocol>-<proxy>",
+             "Proxy format: <protocol>-<proxy>. Songs are spread across the proxies, favouring the fastest, and a "
+             "proxy that keeps failing is rested for a while before it is tried again",
+    )
+    parser.add_argument(
+        "--proxy-streams",
+        type=check_positive,
+        default=DEFAULT_STREAMS,
+        help=f"the most songs to download through any one proxy at the same time (defaults to {DEFAULT_STREAMS})",
     )
     parser.add_argument(
         "-3",
@@ -113,7 +392,138 @@ def parse_args(args):
         const=True,
         default=False,
         help="converts downloaded files to mp3 format and deletes original mp4 file. Requires ffmpeg to be installed "
-             "on your machine",
+             "on your machine. Shorthand for --format mp3",
+    )
+    parser.add_argument(
+        "--format",
+        type=str,
+        choices=sorted(FORMATS),
+        help=f"the format songs are left in (defaults to {DEFAULT_FORMAT}, or mp3 with --mp3). The audio stream that "
+             "can be copied into it without re-encoding is downloaded where YouTube has one (aac for mp4 and m4a, "
+             "opus for opus and ogg), so that ffmpeg only remuxes it; anything else is encoded. Requires ffmpeg "
+             f"for anything but {DEFAULT_FORMAT}",
+    )
+    parser.add_argument(
+        "--stream",
+        type=bool,
+        nargs="?",
+        const=True,
+        default=False,
+        help="with --mp3 or --format, pipes each song straight from the network into ffmpeg so that the downloaded "
+             "file is never written to disk",
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=check_positive,
+        default=1,
+        help="how many songs to download at the same time (defaults to 1). The number is halved whenever YouTube "
+             "starts throttling and grows back while that raises throughput",
+    )
+    parser.add_argument(
+        "--max-rate",
+        type=check_rate,
+        help="caps the combined download speed of all songs and album art, such as 500K or 2M bytes a second. "
+             "Songs that download at the same time share it evenly",
+    )
+    parser.add_argument(
+        "--rate-file",
+        type=str,
+        help="a file holding a rate like --max-rate does. Whenever it changes (or on SIGHUP) the rate of the "
+             "running download changes to match; 'none' lifts the cap",
+    )
+    parser.add_argument(
+        "--max-jobs",
+        type=check_positive,
+        help="lets the number of songs downloaded at the same time grow past --jobs, up to this many, for as long "
+             "as every extra song raises the combined download speed",
+    )
+    parser.add_argument(
+        "-c",
+        "--connections",
+        type=check_positive,
+        help="splits every song into parts and downloads them over this many connections at once. Interrupted "
+             "downloads carry on from the parts that are already on disk",
+    )
+    parser.add_argument(
+        "--prefetch",
+        type=check_non_negative,
+        default=DEFAULT_DEPTH,
+        help="looks up the streams and album art of this many songs ahead of the ones being downloaded, so that "
+             f"no download waits on them (defaults to {DEFAULT_DEPTH}). Set to 0 to look them up as each song starts",
+    )
+    parser.add_argument(
+        "--pool-size",
+        type=check_positive,
+        help="how many connections to keep open per host for reuse (defaults to the number of songs and parts that "
+             "can be downloaded at the same time, and at least 16)",
+    )
+    parser.add_argument(
+        "--timeout",
+        type=check_positive,
+        default=session.DEFAULT_TIMEOUT,
+        help=f"seconds to wait for a server to respond before giving up (defaults to {session.DEFAULT_TIMEOUT})",
+    )
+    parser.add_argument(
+        "--cache-ttl",
+        type=int,
+        default=resolvecache.DEFAULT_TTL,
+        help="seconds for which resolved streams are reused by later runs and retries (defaults to "
+             f"{resolvecache.DEFAULT_TTL}). Set to 0 to always look them and playlists up again",
+    )
+    parser.add_argument(
+        "--playlist-cache-ttl",
+        type=check_non_negative,
+        default=resolvecache.PLAYLIST_TTL,
+        help="seconds for which the list of songs in a playlist is reused by later runs (defaults to "
+             f"{resolvecache.PLAYLIST_TTL}), so that songs added to it since are not missed",
+    )
+    parser.add_argument(
+        "--cache-file",
+        type=str,
+        help="where to keep resolved playlists and streams (defaults to ~/.cache/ytam/resolve.db)",
+    )
+    parser.add_argument(
+        "--art-cache",
+        type=str,
+        help="a directory in which to keep downloaded album art between runs, so that the same cover is never "
+             "downloaded twice",
+    )
+    parser.add_argument(
+        "--no-resume",
+        type=bool,
+        nargs="?",
+        const=True,
+        default=False,
+        help="downloads every song again, even if the download directory already holds a complete copy from a "
+             "previous run",
+    )
+    parser.add_argument(
+        "--library",
+        type=str,
+        nargs="?",
+        const="",
+        help="keeps an index of every song ytam has downloaded, so that a song that shows up in another playlist is "
+             "copied from disk instead of downloaded again. Optionally takes where to keep it (defaults to "
+             "~/.cache/ytam/library.db)",
+    )
+    parser.add_argument(
+        "-r",
+        "--retries",
+        type=check_non_negative,
+        help="retries failed downloads up to this many times without asking, waiting a little longer before each "
+             "attempt. Songs that can never be downloaded, such as private or removed videos, are not retried",
+    )
+    parser.add_argument(
+        "--status-file",
+        type=str,
+        help="writes the outcome of the run to this file as JSON, including every song that failed and why",
+    )
+    parser.add_argument(
+        "--metrics",
+        type=str,
+        help="appends the time every song spent resolving, downloading, tagging and converting, the bytes moved, "
+             "its attempt and proxy to this file as JSON lines, and ends the run with a p50/p95 summary per stage",
     )
     parser.add_argument(
         "-k",
@@ -134,60 +544,88 @@ def parse_args(args):
         default=False,
         help="shows ytam version and exits",
     )
-    return parser.parse_args(args)
+    parsed = parser.parse_args(args)
+    if (parsed.url is None) == (parsed.batch is None):
+        parser.error("give either a playlist URL or --batch")
+    return parsed
 
 
 def main():
     if "--version" in sys.argv[1:] or "-v" in sys.argv[1:]:
-        print(f"ytam version {version.version}")
+        print(f"ytam version {load('version').version}")
         exit()
 
     if "--check" in sys.argv[1:] or "-k" in sys.argv[1:]:
-        urls = Playlist(
-            "https://www.youtube.com/playlist?list=PLOoPqX_q5JAVPMhHjYxcUc2bxTDMyGE-a"
+        resolve_cache = None
+        job = Job(None, None)
+        job.title, job.urls, job.playlist_id = resolve_playlist(
+            "https://www.youtube.com/playlist?list=PLOoPqX_q5JAVPMhHjYxcUc2bxTDMyGE-a", resolve_cache
         )
-        playlist_title = urls.title
-        start = 0
-        end = len(urls)
-        album = "Test Album"
-        directory = f"music{SEP}"
-        artist = "Test Artist"
-        is_album = True
+        job.start = 0
+        job.end = len(job.urls)
+        job.album = "Test Album"
+        job.directory = f"music{SEP}"
+        job.artist = "Test Artist"
+        job.is_album = True
         proxies = None
-        image = f"{BASE}{SEP}check{SEP}check.jpg"
-        titles = f"{BASE}{SEP}check{SEP}check.txt"
+        proxy_pool = None
+        job.image = f"{BASE}{SEP}check{SEP}check.jpg"
+        job.titles = f"{BASE}{SEP}check{SEP}check.txt"
         mp3 = True
+        output_format = None
+        stream = False
         keep_images = True
+        jobs = 1
+        art_cache = None
+        resume = False
+        connections = None
+        pool_size = None
+        timeout = session.DEFAULT_TIMEOUT
+        retries = None
+        status_file = None
+        batch_file = None
+        metrics = None
+        library = None
+        prefetch = DEFAULT_DEPTH
+        max_jobs = None
+        configure_session(jobs, connections, pool_size, timeout, proxies)
 
     else:
         args = parse_args(sys.argv[1:])
         mp3 = args.mp3
-        urls = Playlist(args.url)
-        playlist_title = urls.title
-        start = 0 if args.start is None else args.start - 1
-        end = len(urls) if args.end is None else args.end
-        directory = f"music{SEP}" if args.directory is None else args.directory
+        output_format = args.format
+        stream = args.stream
+        jobs = args.jobs
+        art_cache = args.art_cache
+        resume = not args.no_resume
+        connections = args.connections
+        pool_size = args.pool_size
+        timeout = args.timeout
+        retries = args.retries
+        status_file = args.status_file
+        batch_file = args.batch
+        metrics = Metrics(args.metrics) if args.metrics is not None else None
+        # an empty path stands for the default one
+        library = Library(args.library or None) if args.library is not None else None
+        prefetch = args.prefetch
+        max_jobs = args.max_jobs
+        configure_shaper(args.max_rate, args.rate_file)
+        resolve_cache = None
+        if args.cache_ttl > 0:
+            resolve_cache = resolvecache.ResolveCache(args.cache_file, args.cache_ttl, args.playlist_cache_ttl)
         proxies = None
+        proxy_pool = None
         keep_images = False
         if args.proxy is not None:
-            proxy_strings = [proxy.strip() for proxy in args.proxy.split(" ")]
-            proxies = {}
-            for proxy_string in proxy_strings:
-                p = proxy_string.split("-")
-                proxies[p[0]] = p[1]
+            proxy_pool = ProxyPool(parse_proxies(args.proxy), args.proxy_streams)
+            # album art and Discogs lookups are not spread across the pool, they go through all of it as before
+            proxies = proxy_pool.merged()
+        configure_session(jobs, connections, pool_size, timeout, proxies)
 
-        if args.discogs is not None:
+        if batch_file is None:
             # do discogs error checks here
             try:
-                d = Discogs(args.discogs)
-                d.make_file(DEFAULT_TITLES)
-                if (end - start) != d.num_tracks:
-                    raise error.TracknumberMismatchError(playlist_title, d.album)
-                is_album = True
-                album = d.album
-                artist = d.artist
-                image = d.image
-                titles = DEFAULT_TITLES
+                job = resolve_job(Job(None, args), resolve_cache, metrics=metrics)
             except (
                 error.WrongMetadataLinkError,
                 error.BrokenDiscogsLinkError,
@@ -197,66 +635,91 @@ def main():
                 error.AlbumTracklistNotFoundError
             ) as e:
                 print(f"Error: {e.message}")
-                exit()
+                write_status(status_file, EXIT_ERROR, message=e.message)
+                sys.exit(EXIT_ERROR)
 
-        else:
-            album = playlist_title if args.album is None else args.album
-            artist = "Unknown" if args.artist is None else args.artist
-            is_album = False if args.album is None else True
-            image = args.image
-            titles = args.titles
+    # everything a Downloader is built with that is the same for every playlist
+    shared = {
+        "keep_images": keep_images,
+        "proxies": proxies,
+        "mp3": mp3,
+        "output_format": output_format,
+        "jobs": jobs,
+        "art_cache": ArtCache(art_cache),
+        "resume": resume,
+        "connections": connections,
+        "resolve_cache": resolve_cache,
+        "stream": stream,
+        "proxy_pool": proxy_pool,
+        "metrics": metrics,
+        "library": library,
+        "prefetch": prefetch,
+        "max_jobs": max_jobs,
+    }
 
     colorama.init()
+    if batch_file is not None:
+        try:
+            return run_batch(batch_file, shared, retries, status_file)
+        finally:
+            close_metrics(metrics)
+
     try:
-        if start >= len(urls):
-            raise error.InvalidPlaylistIndexError(start, playlist_title)
-        if end < start:
-            raise error.IndicesOutOfOrderError()
-
-        downloading_message = f"Downloading songs {font.apply('gb', start+1)} - {font.apply('gb', end)} from " \
-                              f"playlist {font.apply('gb', playlist_title)}"
-        text_len = (
-            len("Downloading songs ")
-            + len(str(start))
-            + len(" - ")
-            + len(str(end))
-            + len(" from playlist ")
-            + len(playlist_title)
-        )
+        check_indices(job)
+
+        downloading_message, text_len = playlist_header(job)
         print(downloading_message, f"\n{font.apply('gb', '─'*text_len)}")
-        d = Downloader(
-            list(enumerate(urls[start:end])),
-            len(urls),
-            album,
-            directory,
-            artist,
-            is_album,
-            titles,
-            image,
-            keep_images,
-            proxies,
-            mp3,
-        )
-        d.start = start
+        d = make_downloader(job, shared)
 
-        retry = True
-        while retry:
+        attempt = 0
+        retrying = True
+        while retrying:
             d.download()
+            if len(d.retry_urls) > 0 and resolve_cache is not None:
+                # a track that went missing from the playlist should not be looked for again next time
+                resolve_cache.invalidate_playlist(job.playlist_id)
             print(f"{font.apply('gb', '─'*text_len)}")
-            print(f"{d.successful}/{len(urls[start:end])} downloaded successfully.\n")
-            if len(d.retry_urls) > 0:
+            print(f"{d.successful}/{len(job.urls[job.start:job.end])} downloaded successfully.\n")
+            if proxy_pool is not None:
+                for line in proxy_pool.summary():
+                    print(f"  {line}")
+                print()
+            permanent = len(d.failures) - len(d.retry_urls)
+            if permanent > 0:
+                print(f"{font.apply('fb', str(permanent) + ' failed')} downloads cannot be retried.\n")
+            if len(d.retry_urls) > 0 and retries is None:
                 d.set_retries()
                 urls_copy = d.urls.copy()
                 user = input(
                     f"Retry {font.apply('fb', str(len(list(urls_copy))) + ' failed')} downloads? Y/N "
                 )
                 if not is_affirmative(user):
-                    retry = False
+                    retrying = False
                 else:
                     print("\nRetrying.")
                     print(f"{font.apply('gb', '─'*len('Retrying.'))}")
+            elif len(d.retry_urls) > 0 and attempt < retries:
+                delay = retry.backoff(attempt)
+                attempt += 1
+                d.set_retries()
+                message = f"Retrying {len(d.urls)} failed downloads in {delay:.1f}s (attempt {attempt}/{retries})."
+                print(message)
+                print(f"{font.apply('gb', '─'*len(message))}")
+                time.sleep(delay)
             else:
-                retry = False
+                retrying = False
+
+        failures = [d.failures[song] for song in sorted(d.failures)]
+        status = exit_status(failures)
+        write_status(
+            status_file,
+            status,
+            total=len(job.urls[job.start:job.end]),
+            successful=d.successful,
+            retries=attempt,
+            failures=[failure.as_dict() for failure in failures],
+        )
+        return status
 
     except (
         error.InvalidPlaylistIndexError,
@@ -265,10 +728,14 @@ def main():
         error.BadTitleFormatError,
     ) as e:
         print(f"Error: {e.message}")
+        write_status(status_file, EXIT_ERROR, message=e.message)
+        return EXIT_ERROR
+    finally:
+        close_metrics(metrics)
 
 
 if __name__ == "__main__":
-    main()
+    sys.exit(main())
 
 # https-socks5://98.162.96.41:4145
 # https://18.140.249.11:80
@@ -0,0 +1,110 @@
+import time
+import threading
+
+try:
+    from proxypool import ewma
+    from progress import human_bytes
+except ImportError:
+    from ytam.proxypool import ewma
+    from ytam.progress import human_bytes
+
+# an extra stream has to raise the combined throughput by at least this much to earn the next one
+GAIN = 0.1
+# a stream that runs at less than this share of the average stream speed is being throttled
+THROTTLE_RATIO = 0.25
+# YouTube answers 429 when it rate limits a client and 403 when it stops serving its streams to it
+THROTTLE_STATUSES = {403, 429}
+# shortest time over which the combined throughput is measured, so that one quick song doesn't decide it
+WINDOW = 2.0
+
+
+def rate(n):
+    return f"{human_bytes(n)}/s"
+
+
+class AdaptiveLimit:
+    """Decides how many songs are downloaded at the same time, the way TCP decides how much it sends (AIMD).
+
+    The limit starts at initial and grows by one each time the songs that finished at the current limit (at
+    least `limit` of them, over at least WINDOW seconds) moved more bytes per second between them than before
+    the last increase, up to maximum. It is halved, down to minimum, as soon as a download fails with HTTP 429
+    or 403 or a stream crawls along at a fraction of the average speed. Signals from downloads that started
+    before the last cut are ignored, since they were throttled at the old limit. on_change(limit, reason) is
+    called with every new limit.
+    """
+
+    def __init__(self, initial, maximum=None, minimum=1, on_change=None):
+        self.limit = max(minimum, initial)
+        self.maximum = self.limit if maximum is None else max(self.limit, maximum)
+        self.minimum = minimum
+        self.on_change = on_change
+        self.cond = threading.Condition()
+        self.active = 0
+        self.stream_rate = None
+        # combined throughput of the window before the last increase
+        self.reference = None
+        self.cut_at = time.monotonic()
+        self._new_window()
+
+    def _new_window(self):
+        self.window_started = time.monotonic()
+        self.window_bytes = 0
+        self.window_songs = 0
+
+    def _set(self, limit, reason):
+        self.limit = limit
+        self._new_window()
+        self.cond.notify_all()
+        if self.on_change is not None:
+            self.on_change(limit, reason)
+
+    def _cut(self, started, reason):
+        if started < self.cut_at:
+            return
+        self.cut_at = time.monotonic()
+        self.reference = None
+        if self.limit > self.minimum:
+            self._set(max(self.minimum, self.limit // 2), reason)
+
+    def acquire(self):
+        with self.cond:
+            while self.active >= self.limit:
+                self.cond.wait()
+            self.active += 1
+
+    def release(self):
+        with self.cond:
+            self.active -= 1
+            self.cond.notify()
+
+    def finished(self, nbytes, seconds, started):
+        # a download that started at `started` moved nbytes in seconds
+        with self.cond:
+            speed = nbytes / seconds if seconds > 0 else None
+            if speed is not None and self.stream_rate is not None and speed < self.stream_rate * THROTTLE_RATIO:
+                self._cut(started, f"a song downloaded at {rate(speed)}, the average is {rate(self.stream_rate)}")
+                return
+            if speed is not None:
+                self.stream_rate = ewma(self.stream_rate, speed)
+
+            self.window_bytes += nbytes
+            self.window_songs += 1
+            elapsed = time.monotonic() - self.window_started
+            if self.window_songs < self.limit or elapsed < WINDOW:
+                return
+
+            combined = self.window_bytes / elapsed
+            if self.reference is not None and combined <= self.reference * (1 + GAIN):
+                # no better than with one stream fewer; stays where it is and keeps measuring
+                self._new_window()
+            elif self.limit < self.maximum:
+                previous, self.reference = self.reference, combined
+                gained = "" if previous is None else f", up from {rate(previous)}"
+                self._set(self.limit + 1, f"{rate(combined)} with {self.limit} at a time{gained}")
+            else:
+                self.reference = combined
+                self._new_window()
+
+    def throttled(self, status, started):
+        with self.cond:
+            self._cut(started, f"HTTP {status} from YouTube")
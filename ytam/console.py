@@ -0,0 +1,38 @@
+import threading
+
+
+class TrackConsole:
+    """Prints the output of tracks that are processed concurrently in playlist order.
+
+    Only the track at the head of the order writes straight out. Every other track buffers its lines until all
+    of the tracks before it are done.
+    """
+
+    def __init__(self, keys, out=None):
+        self.lock = threading.Lock()
+        self.out = (lambda text: print(text, flush=True)) if out is None else out
+        self.order = list(keys)
+        self.positions = {key: i for i, key in enumerate(self.order)}
+        self.buffers = {key: [] for key in self.order}
+        self.finished = set()
+        self.head = 0
+
+    def is_live(self, key):
+        return self.head < len(self.order) and self.order[self.head] == key
+
+    def write(self, key, text):
+        with self.lock:
+            # a track that is already done, such as one reporting a failure after it finished, has nothing to wait for
+            if self.positions[key] <= self.head:
+                self.out(text)
+            else:
+                self.buffers[key].append(text)
+
+    def finish(self, key):
+        with self.lock:
+            self.finished.add(key)
+            while self.head < len(self.order) and self.order[self.head] in self.finished:
+                self.head += 1
+                if self.head < len(self.order):
+                    for text in self.buffers.pop(self.order[self.head]):
+                        self.out(text)
@@ -1,13 +1,21 @@
 import sys
 
+import os
 import re
 import json
-from urllib.request import Request, urlopen
+import time
+import threading
+import collections
+from concurrent.futures import ThreadPoolExecutor
 
 try:
     import error
+    import session
+    from paths import cache_dir
 except ModuleNotFoundError:
     import ytam.error as error
+    import ytam.session as session
+    from ytam.paths import cache_dir
 
 IMAGE_TAG = "og:image"
 ARTIST_TAG = "profile_title"
@@ -23,6 +31,15 @@ discogs_url_pattern = re.compile(discogs_url)
 artist_pattern = re.compile(artist_exp)
 image_pattern = re.compile(image_exp)
 
+# unauthenticated clients may make 25 API requests per rolling minute. The limit that actually applies is read
+# back from the X-Discogs-Ratelimit headers of every response
+RATE_LIMIT = 25
+RATE_WINDOW = 60
+MAX_ATTEMPTS = 3
+SCAN_CHUNK_SIZE = 16 * 1024
+# how much of the previous chunk is kept when scanning, so that a tag split between two chunks is still found
+SCAN_OVERLAP = 2 * 1024
+
 
 def clean_artist(artist):
     # discogs will sometimes have a number after the artist name if they have multiple artists by that name in their
@@ -38,6 +55,94 @@ def extract_release_id(discogs_release_url):
     return match.groups()[2]
 
 
+def primary_image(metadata):
+    images = [image for image in metadata.get("images", []) if image.get("uri")]
+    primary = [image for image in images if image.get("type") == "primary"]
+    if len(primary + images) == 0:
+        return None
+    return (primary + images)[0]["uri"]
+
+
+def validators(entry):
+    headers = {}
+    if entry is not None:
+        if entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
+    return headers
+
+
+class RateLimiter:
+    """Spaces out Discogs API requests so that no more than limit of them fall within any window seconds."""
+
+    def __init__(self, limit=RATE_LIMIT, window=RATE_WINDOW):
+        self.limit = limit
+        self.window = window
+        self.lock = threading.Lock()
+        self.sent = collections.deque()
+
+    def wait(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                while len(self.sent) > 0 and now - self.sent[0] >= self.window:
+                    self.sent.popleft()
+                if len(self.sent) < self.limit:
+                    self.sent.append(now)
+                    return
+                delay = self.window - (now - self.sent[0])
+            time.sleep(delay)
+
+    def update(self, headers):
+        with self.lock:
+            limit = headers.get("X-Discogs-Ratelimit")
+            remaining = headers.get("X-Discogs-Ratelimit-Remaining")
+            if limit is not None and limit.isdigit():
+                self.limit = int(limit)
+            if remaining is not None and remaining.isdigit():
+                # discogs knows better than we do how many requests are left; use up the window to match
+                now = time.monotonic()
+                while self.limit - len(self.sent) > int(remaining):
+                    self.sent.append(now)
+
+
+rate_limiter = RateLimiter()
+
+
+class DiscogsCache:
+    """Keeps the API response and the cover found on the release page of every release on disk, along with the
+    validators needed to ask Discogs whether they have changed since."""
+
+    def __init__(self, directory=None):
+        self.directory = cache_dir("discogs") if directory is None else directory
+        self.lock = threading.Lock()
+
+    def _path(self, release_id):
+        return os.path.join(self.directory, f"{release_id}.json")
+
+    def _load(self, release_id):
+        try:
+            with open(self._path(release_id), "r") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def get(self, release_id, kind):
+        with self.lock:
+            return self._load(release_id).get(kind)
+
+    def put(self, release_id, kind, entry):
+        with self.lock:
+            os.makedirs(self.directory, exist_ok=True)
+            entries = self._load(release_id)
+            entries[kind] = entry
+            tmp = f"{self._path(release_id)}.tmp"
+            with open(tmp, "w") as f:
+                json.dump(entries, f)
+            os.replace(tmp, self._path(release_id))
+
+
 class Discogs:
     artist: str
     image: str
@@ -45,52 +150,107 @@ class Discogs:
     tracks: []
     num_tracks: int
 
-    def __init__(self, discogs_release_url):
+    def __init__(self, discogs_release_url, cache=None):
         if not discogs_url_pattern.match(discogs_release_url):
             raise error.WrongMetadataLinkError(discogs_release_url)
 
-        self.extract_image(discogs_release_url)
-        self.extract_metadata(extract_release_id(discogs_release_url))
+        self.cache = DiscogsCache() if cache is None else cache
+        self.lookup(discogs_release_url, extract_release_id(discogs_release_url))
+
+    def lookup(self, discogs_release_url, release_id):
+        # the API response usually has the cover in it already, so the release page is only scanned until the API
+        # has answered - and to the end only if the API turns out not to have one
+        found_in_api = threading.Event()
+        executor = ThreadPoolExecutor(max_workers=1)
+        page = executor.submit(self.extract_image, discogs_release_url, release_id, found_in_api)
+        try:
+            metadata = self.extract_metadata(release_id)
+            image = primary_image(metadata)
+            if image is not None:
+                found_in_api.set()
+            else:
+                image = page.result()
+            # only set here, so that a page scan still running in the background can't change it afterwards
+            self.image = image
+        finally:
+            # a page scan that is no longer needed notices the event and gives up on its own; don't wait for it
+            found_in_api.set()
+            executor.shutdown(wait=False)
 
-    def extract_image(self, discogs_release_url):
+    def extract_image(self, discogs_release_url, release_id, stop=None):
+        # returns the cover the release page links to, or None if stop was set before it was found
+        cached = self.cache.get(release_id, "page")
         try:
-            req = Request(discogs_release_url)
-            req.add_header(
-                "User-Agent",
-                "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_11_5) AppleWebKit/537.36 (KHTML, like Gecko) "
-                "Chrome/50.0.2661.102 Safari/537.36",
-            )
-            fp = urlopen(req)
-            html_bytes = fp.read()
-            fp.close()
+            response = session.get_client().get(discogs_release_url, headers=validators(cached), stream=True)
+            try:
+                if response.status_code == 304 and cached is not None:
+                    return cached["image"]
+                response.raise_for_status()
+                image = self.scan_image(response, stop)
+            finally:
+                response.close()
         except Exception:
             raise error.BrokenDiscogsLinkError(discogs_release_url)
 
-        html_str = html_bytes.decode("utf8")
-        image_tag = image_pattern.findall(html_str)
-        if len(image_tag) > 0:
-            self.image = image_tag[0][0]
-        else:
+        if image is None:
+            if stop is not None and stop.is_set():
+                return None
             raise error.AlbumArtNotFoundError()
 
+        self.cache.put(release_id, "page", {
+            "etag": response.headers.get("ETag"),
+            "last_modified": response.headers.get("Last-Modified"),
+            "image": image,
+        })
+        return image
+
+    @staticmethod
+    def scan_image(response, stop=None):
+        # reads the page a chunk at a time and stops at the first og:image tag instead of downloading all of it
+        tail = ""
+        for chunk in response.iter_content(chunk_size=SCAN_CHUNK_SIZE):
+            if stop is not None and stop.is_set():
+                return None
+            text = tail + chunk.decode("utf8", errors="ignore")
+            image_tag = image_pattern.findall(text)
+            if len(image_tag) > 0:
+                return image_tag[0][0]
+            tail = text[-SCAN_OVERLAP:]
+        return None
+
+    def api_get(self, url, cached):
+        for attempt in range(MAX_ATTEMPTS):
+            rate_limiter.wait()
+            response = session.get_client().get(url, headers=validators(cached))
+            rate_limiter.update(response.headers)
+            if response.status_code != 429:
+                return response
+            retry_after = response.headers.get("Retry-After", "")
+            time.sleep(int(retry_after) if retry_after.isdigit() else rate_limiter.window / rate_limiter.limit)
+        return response
+
     def extract_metadata(self, release_id):
+        url = f"{discogs_api_url}/{release_id}"
+        cached = self.cache.get(release_id, "api")
         try:
-            req = Request(f"{discogs_api_url}/{release_id}")
-            req.add_header(
-                "User-Agent",
-                "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_11_5) AppleWebKit/537.36 (KHTML, like Gecko) "
-                "Chrome/50.0.2661.102 Safari/537.36",
-            )
-            fp = urlopen(req)
-            html_bytes = fp.read()
-            metadata = json.loads(html_bytes.decode("utf8"))
-            fp.close()
+            response = self.api_get(url, cached)
+            if response.status_code == 304 and cached is not None:
+                metadata = cached["body"]
+            else:
+                response.raise_for_status()
+                metadata = json.loads(response.content.decode("utf8"))
+                self.cache.put(release_id, "api", {
+                    "etag": response.headers.get("ETag"),
+                    "last_modified": response.headers.get("Last-Modified"),
+                    "body": metadata,
+                })
             self.artist = clean_artist(metadata["artists"][0]["name"])
             self.album = metadata["title"]
             self.tracks = [title["title"] for title in metadata["tracklist"]]
             self.num_tracks = len(self.tracks)
         except Exception:
-            raise error.BrokenDiscogsLinkError(f"{discogs_api_url}/{release_id}")
+            raise error.BrokenDiscogsLinkError(url)
+        return metadata
 
     def make_file(self, path):
         with open(path, "w") as fh:
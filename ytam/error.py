@@ -56,6 +56,26 @@ class ImageDownloadError(Error):
         self.message = f"Could not download image at {url}."
 
 
+class RangeNotSupportedError(Error):
+    def __init__(self, url):
+        self.message = f"The server at {url} does not support partial downloads."
+
+
+class IncompleteDownloadError(Error):
+    def __init__(self, url, received, expected):
+        self.message = f"Download from {url} stopped at byte {received} of {expected}."
+
+
+class SizeMismatchError(Error):
+    def __init__(self, path, size, expected):
+        self.message = f"{path} holds {size} bytes instead of the {expected} that were expected."
+
+
+class TranscodeError(Error):
+    def __init__(self, returncode, reason):
+        self.message = f"ffmpeg exited with status {returncode}: {reason}"
+
+
 class WrongMetadataLinkError(Error):
     def __init__(self, url):
         self.message = (
@@ -0,0 +1,81 @@
+DEFAULT_FORMAT = "mp4"
+
+# container and codec of the audio-only streams YouTube serves, for streams that were resolved by an earlier run
+# and of which only the itag is known
+AUDIO_ITAGS = {
+    139: ("mp4", "mp4a.40.5"),
+    140: ("mp4", "mp4a.40.2"),
+    141: ("mp4", "mp4a.40.2"),
+    171: ("webm", "vorbis"),
+    172: ("webm", "vorbis"),
+    249: ("webm", "opus"),
+    250: ("webm", "opus"),
+    251: ("webm", "opus"),
+}
+
+
+def stream_source(stream):
+    """Returns (container, codec) of a pytube Stream or a CachedStream."""
+    subtype = getattr(stream, "subtype", None)
+    if subtype is not None:
+        return subtype, getattr(stream, "audio_codec", None)
+    # ytam used to pick nothing but mp4 audio, so that is what an itag it doesn't know stands for
+    return AUDIO_ITAGS.get(stream.itag, ("mp4", "mp4a"))
+
+
+class Format:
+    """A file format ytam can leave songs in.
+
+    ffmpeg writes it with the given muxer. A source whose codec starts with one of copy_codecs is only remuxed
+    into it (-c copy), which takes milliseconds and loses nothing; anything else is encoded with encode_args.
+    """
+
+    def __init__(self, name, ext, muxer, copy_codecs, encode_args):
+        self.name = name
+        self.ext = ext
+        self.muxer = muxer
+        self.copy_codecs = copy_codecs
+        self.encode_args = encode_args
+
+    def can_copy(self, codec):
+        return codec is not None and codec.startswith(self.copy_codecs)
+
+    def codec_args(self, codec):
+        return ["-c:a", "copy"] if self.can_copy(codec) else self.encode_args
+
+    def prefers(self, stream):
+        # whether stream is of the kind choose_stream picks first for this format
+        container, codec = stream_source(stream)
+        return self.can_copy(codec) if len(self.copy_codecs) > 0 else container == "mp4"
+
+
+FORMATS = {
+    # what YouTube serves, left as it was downloaded
+    "mp4": Format("mp4", "mp4", "mp4", ("mp4a",), ["-c:a", "aac"]),
+    "m4a": Format("m4a", "m4a", "ipod", ("mp4a",), ["-c:a", "aac", "-b:a", "192k"]),
+    "opus": Format("opus", "opus", "opus", ("opus",), ["-c:a", "libopus", "-b:a", "160k"]),
+    "ogg": Format("ogg", "ogg", "ogg", ("opus", "vorbis"), ["-c:a", "libopus", "-b:a", "160k"]),
+    # YouTube has no mp3 streams, so this one is always encoded, with ffmpeg's defaults as before
+    "mp3": Format("mp3", "mp3", "mp3", (), []),
+}
+
+
+def abr(stream):
+    try:
+        return int(stream.abr.rstrip("kbps"))
+    except (AttributeError, TypeError, ValueError):
+        return 0
+
+
+def choose_stream(streams, output):
+    """Picks the audio stream to download for output out of a list of pytube Streams: the best one that can be
+    remuxed into it, otherwise the best mp4 one (as ytam always picked), otherwise the best of any."""
+    streams = list(streams)
+    for candidates in (
+        [s for s in streams if output.prefers(s)],
+        [s for s in streams if stream_source(s)[0] == "mp4"],
+        streams,
+    ):
+        if len(candidates) > 0:
+            return max(candidates, key=abr)
+    return None
@@ -0,0 +1,152 @@
+import os
+import time
+import shutil
+import sqlite3
+import threading
+
+try:
+    from paths import cache_dir
+    from manifest import file_digest
+    import staging
+except ImportError:
+    from ytam.paths import cache_dir
+    from ytam.manifest import file_digest
+    import ytam.staging as staging
+
+# ioctl that makes dst share src's blocks on copy-on-write filesystems (btrfs, xfs); see ioctl_ficlone(2)
+FICLONE = 0x40049409
+
+
+def default_path():
+    return cache_dir("library.db")
+
+
+def reflink(src, dst):
+    import fcntl
+
+    with open(src, "rb") as s, open(dst, "wb") as d:
+        fcntl.ioctl(d.fileno(), FICLONE, s.fileno())
+
+
+def clone(src, dst):
+    """Copies src to dst as a reflink where the filesystem supports it and byte for byte where it does not.
+
+    Hardlinks are not used: the copy is tagged for its own album afterwards, and mutagen rewrites files in place,
+    so a hardlink would change the tags of the album it was linked from as well. Returns how the copy was made.
+    """
+    tmp = staging.part_path(dst)
+    try:
+        reflink(src, tmp)
+        how = "reflink"
+    except (ImportError, OSError):
+        shutil.copyfile(src, tmp)
+        how = "copy"
+    staging.commit(tmp, dst, os.path.getsize(src))
+    return how
+
+
+class LibraryEntry:
+    def __init__(self, video_id, path, size, sha256, mtime, title, length):
+        self.video_id = video_id
+        self.path = path
+        self.size = size
+        self.sha256 = sha256
+        self.mtime = mtime
+        self.title = title
+        self.length = length
+
+    @property
+    def ext(self):
+        return os.path.splitext(self.path)[1].lstrip(".")
+
+
+class Library:
+    """A persistent index of every track ytam has finished, across all output directories, so that a video that
+    shows up in another playlist is copied from the file already on disk instead of being downloaded again.
+
+    Entries are keyed by video ID and file format (the extension of the file) and keep the path, size and sha256
+    of the file. A file whose modification time has changed is hashed again before it is reused; one that is gone
+    or no longer matches its hash is dropped from the index.
+    """
+
+    def __init__(self, path=None):
+        self.path = default_path() if path is None else path
+        self.lock = threading.Lock()
+        self.inflight = {}
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        self.db = sqlite3.connect(self.path, check_same_thread=False)
+        with self.db:
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS files "
+                "(video_id TEXT, ext TEXT, path TEXT, size INTEGER, sha256 TEXT, mtime REAL, title TEXT, "
+                "length INTEGER, added_at REAL, PRIMARY KEY (video_id, ext))"
+            )
+
+    def _intact(self, entry):
+        try:
+            stat = os.stat(entry.path)
+        except OSError:
+            return False
+        if stat.st_size != entry.size:
+            return False
+        if stat.st_mtime == entry.mtime:
+            return True
+        if file_digest(entry.path) != entry.sha256:
+            return False
+        with self.lock, self.db:
+            self.db.execute(
+                "UPDATE files SET mtime = ? WHERE video_id = ? AND ext = ?", (stat.st_mtime, entry.video_id, entry.ext)
+            )
+        return True
+
+    def get(self, video_id, exts):
+        """Returns the first intact entry for video_id in one of exts, in order of preference."""
+        for ext in exts:
+            with self.lock:
+                row = self.db.execute(
+                    "SELECT path, size, sha256, mtime, title, length FROM files WHERE video_id = ? AND ext = ?",
+                    (video_id, ext),
+                ).fetchone()
+            if row is None:
+                continue
+            entry = LibraryEntry(video_id, *row)
+            if self._intact(entry):
+                return entry
+            self.forget(video_id, ext)
+        return None
+
+    def add(self, video_id, path, title, length, size=None, sha256=None):
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        if size is None or sha256 is None or size != stat.st_size:
+            size, sha256 = stat.st_size, file_digest(path)
+        ext = os.path.splitext(path)[1].lstrip(".")
+        with self.lock, self.db:
+            self.db.execute(
+                "INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (video_id, ext, path, size, sha256, stat.st_mtime, title, length, time.time()),
+            )
+
+    def claim(self, video_id):
+        """Makes the caller the one that fetches video_id in this process and returns None, or, when another
+        track is already fetching it, returns an Event that is set once that track is done.
+        """
+        with self.lock:
+            event = self.inflight.get(video_id)
+            if event is None:
+                self.inflight[video_id] = threading.Event()
+            return event
+
+    def release(self, video_id):
+        with self.lock:
+            event = self.inflight.pop(video_id, None)
+        if event is not None:
+            event.set()
+
+    def forget(self, video_id, ext):
+        with self.lock, self.db:
+            self.db.execute("DELETE FROM files WHERE video_id = ? AND ext = ?", (video_id, ext))
+
+    def close(self):
+        with self.lock:
+            self.db.close()
@@ -0,0 +1,157 @@
+import os
+import re
+import json
+import weakref
+import hashlib
+import threading
+
+MANIFEST_FILENAME = ".ytam-manifest.json"
+# every change since the manifest was last written out whole, one JSON object per line
+JOURNAL_SUFFIX = ".journal"
+STAGES = ("downloaded", "tagged", "converted")
+
+VIDEO_ID_EXP = r"(?:v=|\/)([0-9A-Za-z_-]{11})(?:[?&#\/]|$)"
+VIDEO_ID_PATTERN = re.compile(VIDEO_ID_EXP)
+
+# resolved output directory -> the Manifest every Downloader that writes there shares, for as long as one holds it
+_manifests = weakref.WeakValueDictionary()
+_manifests_lock = threading.Lock()
+
+
+def extract_video_id(url):
+    match = VIDEO_ID_PATTERN.search(url)
+    return match.group(1) if match else url
+
+
+def file_digest(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def open_manifest(outdir):
+    """Returns the Manifest of outdir. Playlists downloaded into the same directory, by one batch or by several
+    download_playlist calls, share it, since separate ones would each write out only their own tracks.
+    """
+    key = os.path.realpath(outdir)
+    with _manifests_lock:
+        manifest = _manifests.get(key)
+        if manifest is None:
+            manifest = _manifests[key] = Manifest(outdir)
+        return manifest
+
+
+class Manifest:
+    """Records, per video ID, which stages of a track have completed in an output directory.
+
+    Every entry keeps the path, size, modification time and sha256 of the file produced by the last completed
+    stage, so that a later run can check that the file is still there and unchanged before it skips any work.
+    Files are only ever moved into place complete, so one whose size and modification time still match is
+    trusted as it is; only a file that was touched since is hashed again.
+
+    A change only appends a line to a journal next to the manifest, which costs the same however many entries
+    there are. compact() folds the journal into the manifest, at the end of a run; a run that was cut short
+    replays it the next time the manifest is read.
+    """
+
+    def __init__(self, outdir):
+        self.path = os.path.join(outdir, MANIFEST_FILENAME)
+        self.journal = self.path + JOURNAL_SUFFIX
+        self.lock = threading.Lock()
+        self.entries = {}
+        try:
+            with open(self.path, "r") as f:
+                self.entries = json.load(f)
+        except (OSError, ValueError):
+            self.entries = {}
+        if self.replay():
+            # a journal left by a run that was cut short may end in half a line, which would spoil the next one
+            try:
+                self.compact()
+            except OSError:
+                pass
+
+    def replay(self):
+        # returns whether there was a journal
+        try:
+            with open(self.journal, "r") as f:
+                for line in f:
+                    try:
+                        change = json.loads(line)
+                    except ValueError:
+                        # the last line of a run that was killed while writing it
+                        continue
+                    if change["entry"] is None:
+                        self.entries.pop(change["video_id"], None)
+                    else:
+                        self.entries[change["video_id"]] = change["entry"]
+        except OSError:
+            return False
+        return True
+
+    def append(self, video_id):
+        # called with the lock held
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with open(self.journal, "a") as f:
+            f.write(json.dumps({"video_id": video_id, "entry": self.entries.get(video_id)}) + "\n")
+
+    def compact(self):
+        with self.lock:
+            if not os.path.exists(self.journal):
+                return
+            tmp = f"{self.path}.{os.getpid()}.tmp"
+            with open(tmp, "w") as f:
+                json.dump(self.entries, f, indent=1)
+            os.replace(tmp, self.path)
+            os.remove(self.journal)
+
+    def get(self, video_id):
+        with self.lock:
+            return self.entries.get(video_id)
+
+    def verify(self, video_id):
+        """Returns the entry for video_id if its file is still intact, otherwise forgets it and returns None."""
+        entry = self.get(video_id)
+        if entry is None:
+            return None
+
+        path = entry.get("path")
+        try:
+            stat = os.stat(path)
+            intact = stat.st_size == entry.get("size")
+            if intact and stat.st_mtime != entry.get("mtime"):
+                intact = file_digest(path) == entry.get("sha256")
+                if intact:
+                    with self.lock:
+                        entry["mtime"] = stat.st_mtime
+                        self.append(video_id)
+        except (OSError, TypeError):
+            intact = False
+
+        if not intact:
+            self.forget(video_id)
+            return None
+        return entry
+
+    def record(self, video_id, stage, path, drop=(), **info):
+        # drop names stages whose work the file at path no longer carries
+        stat = os.stat(path)
+        digest = file_digest(path)
+        with self.lock:
+            entry = self.entries.setdefault(video_id, {"stages": []})
+            entry.update(info)
+            entry["stages"] = [s for s in entry["stages"] if s not in drop]
+            if stage not in entry["stages"]:
+                entry["stages"].append(stage)
+            entry["path"] = path
+            entry["size"] = stat.st_size
+            entry["mtime"] = stat.st_mtime
+            entry["sha256"] = digest
+            self.append(video_id)
+
+    def forget(self, video_id):
+        with self.lock:
+            if self.entries.pop(video_id, None) is not None:
+                self.append(video_id)
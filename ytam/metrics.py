@@ -0,0 +1,110 @@
+import json
+import math
+import time
+import threading
+
+MB = 1024 * 1024
+
+
+def percentile(values, p):
+    # nearest rank, which is always one of the values measured
+    if len(values) == 0:
+        return None
+    ordered = sorted(values)
+    rank = max(0, math.ceil(p / 100.0 * len(ordered)) - 1)
+    return ordered[rank]
+
+
+def throughput(nbytes, seconds):
+    return round(nbytes / MB / seconds, 3) if seconds > 0 else None
+
+
+class Metrics:
+    """Writes what every track spent in each stage to a file as JSON lines, one record per line.
+
+    Each track leaves one "track" record with the wall time of its stages (resolve, transfer, stream, tag,
+    convert), bytes moved and effective MB/s, the attempt it was on and the proxy it went through. Other events,
+    such as resolving a playlist, get records of their own, and summary() closes a run with the p50/p95 of
+    every stage.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.file = open(path, "a")
+        self.started = time.time()
+        self.seconds = {}
+        self.bytes = {}
+        self.tracks = 0
+        self.failed = 0
+
+    def _write(self, record):
+        self.file.write(json.dumps(record) + "\n")
+        self.file.flush()
+
+    def _add(self, stage, seconds, nbytes=None):
+        self.seconds.setdefault(stage, []).append(seconds)
+        if nbytes is not None:
+            self.bytes[stage] = self.bytes.get(stage, 0) + nbytes
+
+    def event(self, kind, seconds=None, **info):
+        record = {"type": kind, "time": round(time.time(), 3)}
+        if seconds is not None:
+            record["seconds"] = round(seconds, 4)
+        record.update(info)
+        with self.lock:
+            if seconds is not None:
+                self._add(kind, seconds)
+            self._write(record)
+
+    def track(self, track, outdir=None):
+        record = {
+            "type": "track",
+            "time": round(time.time(), 3),
+            "song": track.song,
+            "video_id": track.video_id,
+            "title": track.title,
+            "outdir": outdir,
+            "status": "ok" if track.path is not None else "failed",
+            "attempt": track.attempt,
+            "proxy": track.proxy_name,
+            "stages": track.timings,
+        }
+        if track.error is not None:
+            record["error"] = str(track.error) or type(track.error).__name__
+        with self.lock:
+            self.tracks += 1
+            if track.path is None:
+                self.failed += 1
+            for stage, timing in track.timings.items():
+                self._add(stage, timing["seconds"], timing.get("bytes"))
+            self._write(record)
+
+    def summary(self):
+        with self.lock:
+            stages = {}
+            for stage, seconds in self.seconds.items():
+                total = sum(seconds)
+                stages[stage] = {
+                    "count": len(seconds),
+                    "p50": round(percentile(seconds, 50), 4),
+                    "p95": round(percentile(seconds, 95), 4),
+                    "total": round(total, 4),
+                }
+                if stage in self.bytes:
+                    stages[stage]["bytes"] = self.bytes[stage]
+                    stages[stage]["mb_per_s"] = throughput(self.bytes[stage], total)
+            record = {
+                "type": "summary",
+                "time": round(time.time(), 3),
+                "wall_s": round(time.time() - self.started, 3),
+                "tracks": self.tracks,
+                "failed": self.failed,
+                "stages": stages,
+            }
+            self._write(record)
+            return record
+
+    def close(self):
+        with self.lock:
+            self.file.close()
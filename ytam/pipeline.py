@@ -0,0 +1,107 @@
+import queue
+import threading
+import traceback
+
+_STOP = object()
+
+
+class Stage:
+    def __init__(self, name, func, workers, maxsize, limit=None):
+        self.name = name
+        self.func = func
+        self.workers = workers
+        self.limit = limit
+        self.queue = queue.Queue(maxsize=maxsize)
+        self.threads = []
+
+
+class Pipeline:
+    """Passes items through a chain of stages, each with its own pool of worker threads.
+
+    Stages are connected by bounded queues, so a slow stage holds back the ones in front of it instead of
+    letting finished work pile up in memory. A stage function returns True to hand the item on to the next
+    stage or False to drop it; on_done is called exactly once for every item, whichever way it left the
+    pipeline. After cancel() no stage function is called any more; the items left are passed to on_done as they
+    are drained. A stage function that raises drops the item, after on_error(item, stage name, exception) has
+    been told why; on_done raising is reported the same way, as the stage "done", and never stops a worker. A stage can be given a limit (anything with acquire() and release(), such as an AdaptiveLimit)
+    that decides how many of its workers may work at the same time.
+    """
+
+    def __init__(self, on_done=None, on_error=None):
+        self.stages = []
+        self.on_done = on_done
+        self.on_error = on_error
+        self.cancelled = threading.Event()
+
+    def add_stage(self, name, func, workers=1, maxsize=None, limit=None):
+        workers = max(1, workers)
+        self.stages.append(Stage(name, func, workers, workers if maxsize is None else maxsize, limit))
+        return self
+
+    def cancel(self):
+        self.cancelled.set()
+
+    def _report(self, item, name, e):
+        if self.on_error is None:
+            return
+        try:
+            self.on_error(item, name, e)
+        except Exception:
+            # there is no one left to tell, and the worker still has other items to see through
+            traceback.print_exc()
+
+    def _finish(self, item):
+        if self.on_done is not None:
+            try:
+                self.on_done(item)
+            except Exception as e:
+                self._report(item, "done", e)
+
+    def _work(self, index):
+        stage = self.stages[index]
+        while True:
+            if stage.limit is not None:
+                stage.limit.acquire()
+            item = stage.queue.get()
+            if item is _STOP:
+                if stage.limit is not None:
+                    stage.limit.release()
+                return
+
+            if self.cancelled.is_set():
+                if stage.limit is not None:
+                    stage.limit.release()
+                self._finish(item)
+                continue
+
+            try:
+                proceed = stage.func(item)
+            except Exception as e:
+                proceed = False
+                self._report(item, stage.name, e)
+            finally:
+                if stage.limit is not None:
+                    stage.limit.release()
+
+            if proceed and index + 1 < len(self.stages):
+                self.stages[index + 1].queue.put(item)
+            else:
+                self._finish(item)
+
+    def run(self, items):
+        for index, stage in enumerate(self.stages):
+            for n in range(stage.workers):
+                t = threading.Thread(target=self._work, args=(index,), name=f"ytam-{stage.name}-{n}", daemon=True)
+                t.start()
+                stage.threads.append(t)
+
+        for item in items:
+            self.stages[0].queue.put(item)
+
+        # shut the stages down front to back so that every item still in flight reaches the end first
+        for stage in self.stages:
+            for _ in stage.threads:
+                stage.queue.put(_STOP)
+            for t in stage.threads:
+                t.join()
+            stage.threads = []
@@ -0,0 +1,102 @@
+import queue
+import threading
+
+DEFAULT_DEPTH = 4
+
+_STOP = object()
+
+
+class _Result:
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class Prefetcher:
+    """Runs func on the items a consumer is about to reach, up to depth items ahead of it, so that what an item
+    needs is already looked up by the time a worker takes it.
+
+    Items are fed in the order given. take(item) waits for the item's result (re-raising what func raised) and
+    returns None if the item was never fetched ahead, in which case the caller looks it up itself. Every item
+    holds one of the depth slots from the moment it is fetched ahead until it is taken or discarded, so the
+    prefetcher never runs further ahead than that, however slowly the consumer goes.
+    """
+
+    def __init__(self, func, depth=DEFAULT_DEPTH, key=None):
+        self.func = func
+        self.depth = depth
+        self.key = (lambda item: item) if key is None else key
+        self.slots = threading.Semaphore(depth)
+        self.lock = threading.Lock()
+        self.results = {}
+        # items that were taken or discarded before the feeder got to them
+        self.gone = set()
+        self.queue = queue.Queue()
+        self.stopped = threading.Event()
+        self.feeder = None
+
+    def _feed(self, items):
+        for item in items:
+            while not self.slots.acquire(timeout=0.1):
+                if self.stopped.is_set():
+                    return
+            key = self.key(item)
+            with self.lock:
+                if self.stopped.is_set() or key in self.gone:
+                    self.slots.release()
+                    continue
+                result = self.results[key] = _Result()
+            self.queue.put((item, result))
+
+    def _work(self):
+        while True:
+            job = self.queue.get()
+            if job is _STOP:
+                return
+            item, result = job
+            if not self.stopped.is_set():
+                try:
+                    result.value = self.func(item)
+                except Exception as e:
+                    result.error = e
+            result.done.set()
+
+    def start(self, items):
+        # one worker per slot, so that everything that has been fed is being worked on
+        for n in range(self.depth):
+            threading.Thread(target=self._work, name=f"ytam-prefetch-{n}", daemon=True).start()
+        self.feeder = threading.Thread(target=self._feed, args=(list(items),), name="ytam-prefetch", daemon=True)
+        self.feeder.start()
+        return self
+
+    def _pop(self, item):
+        key = self.key(item)
+        with self.lock:
+            result = self.results.pop(key, None)
+            if result is None:
+                self.gone.add(key)
+            return result
+
+    def take(self, item):
+        result = self._pop(item)
+        if result is None:
+            return None
+        result.done.wait()
+        self.slots.release()
+        if result.error is not None:
+            raise result.error
+        return result.value
+
+    def discard(self, item):
+        # for items that finished without being taken; whatever was fetched for them is dropped
+        if self._pop(item) is not None:
+            self.slots.release()
+
+    def stop(self):
+        # lookups that are already running are left to finish on their own
+        self.stopped.set()
+        if self.feeder is not None:
+            self.feeder.join()
+        for _ in range(self.depth):
+            self.queue.put(_STOP)
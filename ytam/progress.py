@@ -0,0 +1,144 @@
+import sys
+import time
+import threading
+
+try:
+    import font
+except ModuleNotFoundError:
+    import ytam.font as font
+
+INTERVAL = 0.1
+PLAIN_INTERVAL = 5.0
+TITLE_WIDTH = 40
+
+
+def human_bytes(n):
+    if n < 1024:
+        return f"{int(n)} B"
+    for unit in ("KB", "MB", "GB"):
+        n /= 1024.0
+        if n < 1024 or unit == "GB":
+            return f"{n:.1f} {unit}"
+
+
+class TrackState:
+    __slots__ = ("song", "title", "size", "done", "stage", "percent", "started")
+
+    def __init__(self, song, title, size):
+        self.song = song
+        # long titles would wrap and throw off the cursor movement that redraws the status block
+        self.title = title if len(title) <= TITLE_WIDTH else f"{title[:TITLE_WIDTH - 3]}..."
+        self.size = size
+        self.done = 0
+        self.stage = "Downloading"
+        self.percent = None
+        self.started = time.monotonic()
+
+
+class ProgressRenderer:
+    """Draws the progress of every track in flight from a thread of its own, a fixed number of times a second.
+
+    Download callbacks only update counters here, which is cheap enough to do for every chunk. On a terminal
+    the renderer keeps a block of status lines at the bottom of the screen, one per active track plus a total,
+    and prints finished lines above it. Anywhere else it prints a plain summary line every few seconds.
+    """
+
+    def __init__(self, total_tracks, out=None, interval=INTERVAL, plain_interval=PLAIN_INTERVAL):
+        self.out = sys.stdout if out is None else out
+        self.tty = hasattr(self.out, "isatty") and self.out.isatty()
+        self.total_tracks = total_tracks
+        self.interval = interval if self.tty else plain_interval
+        self.lock = threading.Lock()
+        self.tracks = {}
+        self.finished = 0
+        self.bytes_done = 0
+        self.started = time.monotonic()
+        self.drawn_lines = 0
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def start(self):
+        self.started = time.monotonic()
+        self.thread = threading.Thread(target=self._run, name="ytam-progress", daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join()
+        with self.lock:
+            self._erase()
+            self.out.flush()
+
+    def start_track(self, key, song, title, size):
+        with self.lock:
+            if key not in self.tracks:
+                self.tracks[key] = TrackState(song, title, size)
+
+    def set_bytes(self, key, done):
+        with self.lock:
+            state = self.tracks.get(key)
+            if state is not None:
+                self.bytes_done += done - state.done
+                state.done = done
+
+    def set_stage(self, key, stage, percent=None):
+        with self.lock:
+            state = self.tracks.get(key)
+            if state is not None:
+                state.stage = stage
+                state.percent = percent
+
+    def finish_track(self, key):
+        with self.lock:
+            self.tracks.pop(key, None)
+            self.finished += 1
+
+    def println(self, text):
+        # lines that are printed for good go above the status block, which is redrawn on the next tick
+        with self.lock:
+            self._erase()
+            self.out.write(f"{text}\n")
+            self.out.flush()
+
+    def _run(self):
+        while not self.stop_event.wait(self.interval):
+            with self.lock:
+                if self.tty:
+                    self._draw()
+                else:
+                    self.out.write(f"{self._summary()}\n")
+                self.out.flush()
+
+    def _rate(self, n, since):
+        elapsed = time.monotonic() - since
+        return n / elapsed if elapsed > 0 else 0.0
+
+    def _summary(self):
+        return (
+            f"{self.finished}/{self.total_tracks} songs done - {human_bytes(self.bytes_done)} at "
+            f"{human_bytes(self._rate(self.bytes_done, self.started))}/s"
+        )
+
+    def _track_line(self, state):
+        if state.percent is not None:
+            p = state.percent
+        else:
+            p = (state.done * 100.0) / state.size if state.size else 0.0
+        return (
+            f"  {state.stage} song {font.apply('gb', str(state.song))} - {state.title} - [{p:.2f}%] "
+            f"{human_bytes(self._rate(state.done, state.started))}/s"
+        )
+
+    def _erase(self):
+        if self.drawn_lines > 0:
+            self.out.write(f"\033[{self.drawn_lines}A\r\033[J")
+            self.drawn_lines = 0
+
+    def _draw(self):
+        self._erase()
+        lines = [self._track_line(state) for state in self.tracks.values()]
+        lines.append(font.apply("b", self._summary()))
+        self.out.write("\n".join(lines) + "\n")
+        self.drawn_lines = len(lines)
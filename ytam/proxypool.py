@@ -0,0 +1,175 @@
+import time
+import threading
+
+try:
+    from progress import human_bytes
+except ImportError:
+    from ytam.progress import human_bytes
+
+# a proxy is taken out of rotation after this many failures in a row, for a cooldown that doubles every time it
+# happens again, up to MAX_COOLDOWN
+EJECT_AFTER = 3
+COOLDOWN = 30.0
+MAX_COOLDOWN = 15 * 60.0
+# weight of the newest sample in the moving averages
+SMOOTHING = 0.3
+DEFAULT_STREAMS = 4
+
+
+def parse_proxies(string):
+    """Reads "<protocol>-<proxy> <protocol>-<proxy> ..." as given to --proxy into the protocol maps of the pool
+    members: one per proxy address, carrying every protocol it was given for.
+
+    A track sends all of its requests, http and https alike, through its member, so a member that lacks a
+    protocol some other member has would let that protocol's requests go direct. When the addresses don't all
+    cover the same protocols, the proxies are kept together as a single member, as they were before the pool.
+    """
+    members = {}
+    for proxy_string in string.split(" "):
+        proxy_string = proxy_string.strip()
+        if proxy_string == "":
+            continue
+        protocol, address = proxy_string.split("-", 1)
+        members.setdefault(address, {})[protocol] = address
+
+    proxies = list(members.values())
+    protocols = {protocol for member in proxies for protocol in member}
+    if any(member.keys() != protocols for member in proxies):
+        merged = {}
+        for member in proxies:
+            merged.update(member)
+        return [merged]
+    return proxies
+
+
+def ewma(average, sample):
+    return sample if average is None else (SMOOTHING * sample) + ((1 - SMOOTHING) * average)
+
+
+class Proxy:
+    def __init__(self, proxies):
+        self.proxies = proxies
+        self.name = " ".join(f"{protocol}-{address}" for protocol, address in proxies.items())
+        self.active = 0
+        self.succeeded = 0
+        self.failed = 0
+        self.latency = None
+        self.throughput = None
+        self.error_rate = 0.0
+        self.failures = 0
+        self.ejections = 0
+        self.ejected_until = 0.0
+        self.probing = False
+
+    def score(self):
+        # untried proxies go first so every proxy gets measured; after that, the fastest and most reliable win
+        if self.throughput is None:
+            return float("inf")
+        return self.throughput * (1.0 - self.error_rate) / (1 + self.active)
+
+
+class ProxyPool:
+    """Spreads tracks across a set of proxies according to how well each of them has been doing.
+
+    Every proxy carries moving averages of its latency, throughput and error rate. No proxy runs more than
+    max_streams transfers at once; acquire() blocks until one has room. A proxy that keeps failing is taken out
+    of rotation for a while, then let back in for a single probe transfer that decides whether it stays. The
+    last proxy still in rotation is never taken out, since the tracks would only wait for it to come back.
+    """
+
+    def __init__(self, proxies, max_streams=DEFAULT_STREAMS):
+        self.members = [Proxy(p) for p in proxies]
+        self.max_streams = max_streams
+        self.condition = threading.Condition()
+
+    def __len__(self):
+        return len(self.members)
+
+    def merged(self):
+        proxies = {}
+        for member in self.members:
+            proxies.update(member.proxies)
+        return proxies
+
+    def _available(self, now):
+        available = []
+        for member in self.members:
+            if member.ejected_until > now:
+                continue
+            if member.ejected_until > 0 and (member.probing or member.active > 0):
+                # back from a cooldown: one probe at a time until it has proven itself again
+                continue
+            if member.active < self.max_streams:
+                available.append(member)
+        return available
+
+    def acquire(self):
+        with self.condition:
+            while True:
+                now = time.monotonic()
+                available = self._available(now)
+                if len(available) > 0:
+                    member = max(available, key=lambda m: m.score())
+                    member.active += 1
+                    if member.ejected_until > 0:
+                        member.probing = True
+                    return member
+
+                # wake up when a proxy is released or when the first cooldown runs out
+                cooldowns = [m.ejected_until - now for m in self.members if m.ejected_until > now]
+                self.condition.wait(min(cooldowns) if len(cooldowns) > 0 else None)
+
+    def _last_usable(self, member, now):
+        return all(m is member or m.ejected_until > now for m in self.members)
+
+    def release(self, member, ok, nbytes=0, seconds=None, latency=None):
+        # ok is None for a transfer that failed for reasons of its own (a removed video, a full disk), which say
+        # nothing about the proxy
+        with self.condition:
+            member.active -= 1
+            if ok is None:
+                member.probing = False
+                self.condition.notify_all()
+                return
+
+            member.error_rate = ewma(member.error_rate, 0.0 if ok else 1.0)
+            if latency is not None:
+                member.latency = ewma(member.latency, latency)
+            if ok and seconds:
+                member.throughput = ewma(member.throughput, nbytes / seconds)
+
+            if ok:
+                member.succeeded += 1
+                member.failures = 0
+                member.probing = False
+                member.ejections = 0
+                member.ejected_until = 0.0
+            else:
+                member.failed += 1
+                member.failures += 1
+                if (member.probing or member.failures >= EJECT_AFTER) and self._last_usable(member, time.monotonic()):
+                    # back in full rotation rather than probed one transfer at a time
+                    member.probing = False
+                    member.failures = 0
+                    member.ejected_until = 0.0
+                elif member.probing or member.failures >= EJECT_AFTER:
+                    member.ejections += 1
+                    member.ejected_until = time.monotonic() + min(
+                        COOLDOWN * (2 ** (member.ejections - 1)), MAX_COOLDOWN
+                    )
+                    member.probing = False
+                    member.failures = 0
+            self.condition.notify_all()
+
+    def summary(self):
+        lines = []
+        with self.condition:
+            for member in self.members:
+                latency = "-" if member.latency is None else f"{member.latency * 1000:.0f} ms"
+                throughput = "-" if member.throughput is None else f"{human_bytes(member.throughput)}/s"
+                state = " (resting)" if member.ejected_until > time.monotonic() else ""
+                lines.append(
+                    f"{member.name}{state} - {member.succeeded} ok, {member.failed} failed - latency {latency} - "
+                    f"{throughput}"
+                )
+        return lines
@@ -0,0 +1,127 @@
+import os
+import json
+import time
+import sqlite3
+import threading
+from urllib.parse import urlparse, parse_qs
+
+try:
+    from paths import cache_dir
+except ImportError:
+    from ytam.paths import cache_dir
+
+DEFAULT_TTL = 24 * 60 * 60
+# playlists change while their streams don't, so a listing is only reused by a run that comes straight after
+PLAYLIST_TTL = 5 * 60
+# signed stream URLs stop working at their "expire" timestamp; don't hand one out this close to it
+EXPIRY_MARGIN = 10 * 60
+
+
+def default_path():
+    return cache_dir("resolve.db")
+
+
+def stream_expiry(url):
+    try:
+        return int(parse_qs(urlparse(url).query)["expire"][0])
+    except (KeyError, IndexError, ValueError):
+        return None
+
+
+class CachedPlaylist:
+    def __init__(self, playlist_id, title, video_urls):
+        self.playlist_id = playlist_id
+        self.title = title
+        self.video_urls = video_urls
+
+
+class CachedStream:
+    """Stands in for a pytube Stream whose details were resolved by an earlier run."""
+
+    def __init__(self, video_id, title, length, itag, filesize, url):
+        self.video_id = video_id
+        self.title = title
+        self.length = length
+        self.itag = itag
+        self.filesize = filesize
+        self.url = url
+
+
+class ResolveCache:
+    """An SQLite cache of resolved playlists and audio streams, so that re-runs and retries can skip the
+    round trips to YouTube that pytube would otherwise make before the first byte is downloaded.
+
+    Streams older than ttl seconds and playlists older than playlist_ttl seconds are ignored, and a stream is only
+    reused while its signed URL is still valid. Anything that fails when used is invalidated so that it is resolved afresh next time.
+    """
+
+    def __init__(self, path=None, ttl=DEFAULT_TTL, playlist_ttl=PLAYLIST_TTL):
+        self.path = default_path() if path is None else path
+        self.ttl = ttl
+        self.playlist_ttl = playlist_ttl
+        self.lock = threading.Lock()
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        self.db = sqlite3.connect(self.path, check_same_thread=False)
+        with self.db:
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS playlists "
+                "(playlist_id TEXT PRIMARY KEY, title TEXT, video_urls TEXT, fetched_at REAL)"
+            )
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS streams "
+                "(video_id TEXT PRIMARY KEY, title TEXT, length INTEGER, itag INTEGER, filesize INTEGER, url TEXT, "
+                "expires INTEGER, fetched_at REAL)"
+            )
+
+    def _fresh(self, fetched_at, ttl):
+        return time.time() - fetched_at < ttl
+
+    def get_playlist(self, playlist_id):
+        with self.lock:
+            row = self.db.execute(
+                "SELECT title, video_urls, fetched_at FROM playlists WHERE playlist_id = ?", (playlist_id,)
+            ).fetchone()
+        if row is None or not self._fresh(row[2], self.playlist_ttl):
+            return None
+        return CachedPlaylist(playlist_id, row[0], json.loads(row[1]))
+
+    def put_playlist(self, playlist_id, title, video_urls):
+        with self.lock, self.db:
+            self.db.execute(
+                "INSERT OR REPLACE INTO playlists VALUES (?, ?, ?, ?)",
+                (playlist_id, title, json.dumps(list(video_urls)), time.time()),
+            )
+
+    def invalidate_playlist(self, playlist_id):
+        with self.lock, self.db:
+            self.db.execute("DELETE FROM playlists WHERE playlist_id = ?", (playlist_id,))
+
+    def get_stream(self, video_id):
+        with self.lock:
+            row = self.db.execute(
+                "SELECT title, length, itag, filesize, url, expires, fetched_at FROM streams WHERE video_id = ?",
+                (video_id,),
+            ).fetchone()
+        if row is None or not self._fresh(row[6], self.ttl):
+            return None
+        if row[5] is None or row[5] - EXPIRY_MARGIN < time.time():
+            return None
+        return CachedStream(video_id, row[0], row[1], row[2], row[3], row[4])
+
+    def put_stream(self, video_id, title, length, stream):
+        with self.lock, self.db:
+            self.db.execute(
+                "INSERT OR REPLACE INTO streams VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    video_id, title, length, stream.itag, stream.filesize, stream.url, stream_expiry(stream.url),
+                    time.time(),
+                ),
+            )
+
+    def invalidate_stream(self, video_id):
+        with self.lock, self.db:
+            self.db.execute("DELETE FROM streams WHERE video_id = ?", (video_id,))
+
+    def close(self):
+        with self.lock:
+            self.db.close()
@@ -0,0 +1,46 @@
+import random
+
+try:
+    import error
+except ModuleNotFoundError:
+    import ytam.error as error
+
+TRANSIENT = "transient"
+PERMANENT = "permanent"
+
+BASE_DELAY = 2.0
+MAX_DELAY = 60.0
+
+# 403 is left out on purpose: signed stream URLs answer it once they expire, and they are resolved afresh on a retry
+PERMANENT_STATUSES = {400, 401, 404, 410}
+
+
+def http_status(e):
+    # requests hangs the response off its HTTPError, urllib (which pytube uses) puts the code on the error itself
+    response = getattr(e, "response", None)
+    status = getattr(response, "status_code", None)
+    if status is None:
+        status = getattr(e, "code", None)
+    return status if isinstance(status, int) else None
+
+
+def classify(e):
+    """Tells failures worth another attempt (timeouts, resets, throttling, server errors) from ones that will
+    fail the same way every time. Anything unrecognised counts as transient, since retries are bounded anyway.
+    """
+    # pytube is already loaded by the time anything has failed; importing it here keeps it out of ytam's startup
+    from pytube.exceptions import VideoUnavailable
+
+    if isinstance(e, KeyboardInterrupt):
+        return PERMANENT
+    # private, removed, region blocked, members only, age restricted and live videos all derive from VideoUnavailable
+    if isinstance(e, (VideoUnavailable, error.RangeNotSupportedError)):
+        return PERMANENT
+    if http_status(e) in PERMANENT_STATUSES:
+        return PERMANENT
+    return TRANSIENT
+
+
+def backoff(attempt, base=BASE_DELAY, cap=MAX_DELAY):
+    # exponential backoff with full jitter, so that parallel runs that failed together don't retry together
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
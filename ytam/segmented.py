@@ -0,0 +1,155 @@
+import os
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import error
+    import session
+    import shaper
+    import staging
+except ModuleNotFoundError:
+    import ytam.error as error
+    import ytam.session as session
+    import ytam.shaper as shaper
+    import ytam.staging as staging
+
+SEGMENT_SIZE = 2 * 1024 * 1024
+CHUNK_SIZE = 64 * 1024
+
+
+class SegmentedDownload:
+    """Downloads one stream as byte ranges over several connections into a preallocated file.
+
+    The file is written to <path>.part and the indices of the finished segments are kept next to it in
+    <path>.part.json, so an interrupted download carries on from the segments that are already on disk
+    instead of starting again from byte zero. Only a complete file is moved to path.
+
+    on_progress(chunk, bytes_remaining) is called as data arrives, like pytube's on_progress callback. proxies, if
+    given, override the session's proxies for these requests.
+    """
+
+    def __init__(
+            self, url, filesize, path, connections=4, segment_size=SEGMENT_SIZE, on_progress=None, proxies=None
+    ):
+        self.url = url
+        self.filesize = filesize
+        self.path = path
+        self.part_path = staging.part_path(path)
+        self.state_path = staging.state_path(self.part_path)
+        self.connections = max(1, connections)
+        self.segment_size = segment_size
+        self.on_progress = on_progress
+        self.proxies = proxies
+        self.lock = threading.Lock()
+        self.done = set()
+        self.bytes_remaining = filesize
+
+    def segments(self):
+        return [
+            (index, start, min(start + self.segment_size, self.filesize) - 1)
+            for index, start in enumerate(range(0, self.filesize, self.segment_size))
+        ]
+
+    def load_state(self):
+        try:
+            with open(self.state_path, "r") as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return set()
+
+        same_layout = state.get("filesize") == self.filesize and state.get("segment_size") == self.segment_size
+        if not same_layout or os.path.getsize(self.part_path) != self.filesize:
+            return set()
+        return set(state.get("done", []))
+
+    def save_state(self):
+        tmp = f"{self.state_path}.tmp"
+        with open(tmp, "w") as f:
+            json.dump({"filesize": self.filesize, "segment_size": self.segment_size, "done": sorted(self.done)}, f)
+        os.replace(tmp, self.state_path)
+
+    def preallocate(self):
+        staging.preallocate(self.part_path, self.filesize)
+
+    def report(self, chunk):
+        with self.lock:
+            self.bytes_remaining -= len(chunk)
+            if self.on_progress is not None:
+                self.on_progress(chunk, self.bytes_remaining)
+
+    def fetch(self, segment):
+        index, start, end = segment
+        response = session.get_client().get(
+            self.url, headers={"Range": f"bytes={start}-{end}"}, stream=True, proxies=self.proxies
+        )
+        try:
+            response.raise_for_status()
+            if response.status_code != 206:
+                raise error.RangeNotSupportedError(self.url)
+
+            received = 0
+            with open(self.part_path, "r+b") as f:
+                f.seek(start)
+                for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+                    f.write(chunk)
+                    received += len(chunk)
+                    self.report(chunk)
+                    shaper.throttle(len(chunk))
+        finally:
+            response.close()
+
+        if received != end - start + 1:
+            # this segment is not marked as done, so it is fetched again in full on the next attempt
+            raise error.IncompleteDownloadError(self.url, start + received, end + 1)
+
+        with self.lock:
+            self.done.add(index)
+            self.save_state()
+
+    def run(self):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        if os.path.exists(self.part_path):
+            self.done = self.load_state()
+        self.preallocate()
+
+        todo = [segment for segment in self.segments() if segment[0] not in self.done]
+        self.bytes_remaining = sum(end - start + 1 for _, start, end in todo)
+
+        if len(todo) > 0:
+            with ThreadPoolExecutor(max_workers=min(self.connections, len(todo))) as executor:
+                for _ in executor.map(self.fetch, todo):
+                    pass
+        elif self.on_progress is not None:
+            self.on_progress(b"", 0)
+
+        staging.commit(self.part_path, self.path, self.filesize)
+        return self.path
+
+
+def iter_ranges(url, filesize, on_progress=None, segment_size=SEGMENT_SIZE, proxies=None):
+    """Yields the bytes of a stream in order, fetching it one byte range at a time over a single connection."""
+    bytes_remaining = filesize
+    for start in range(0, filesize, segment_size):
+        end = min(start + segment_size, filesize) - 1
+        response = session.get_client().get(
+            url, headers={"Range": f"bytes={start}-{end}"}, stream=True, proxies=proxies
+        )
+        try:
+            response.raise_for_status()
+            if response.status_code != 206:
+                raise error.RangeNotSupportedError(url)
+
+            received = 0
+            for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+                received += len(chunk)
+                bytes_remaining -= len(chunk)
+                shaper.throttle(len(chunk))
+                yield chunk
+                if on_progress is not None:
+                    on_progress(chunk, bytes_remaining)
+        finally:
+            response.close()
+
+        if received != end - start + 1:
+            raise error.IncompleteDownloadError(url, start + received, end + 1)
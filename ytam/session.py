@@ -0,0 +1,57 @@
+import threading
+
+USER_AGENT = (
+    "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_11_5) AppleWebKit/537.36 (KHTML, like Gecko) "
+    "Chrome/50.0.2661.102 Safari/537.36"
+)
+DEFAULT_POOL_SIZE = 16
+DEFAULT_TIMEOUT = 30
+
+_client = None
+_client_lock = threading.Lock()
+
+
+class Client:
+    """The HTTP client that all of ytam's own requests go through.
+
+    One requests.Session is shared by every thread, so connections to the same host are kept alive and reused
+    instead of paying for a new TCP and TLS handshake on every image, Discogs lookup and stream segment.
+    """
+
+    def __init__(self, pool_size=DEFAULT_POOL_SIZE, timeout=DEFAULT_TIMEOUT, proxies=None):
+        # requests is imported here rather than at the top so that ytam only pays for it once it makes a request
+        import requests
+        from requests.adapters import HTTPAdapter
+
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.session.headers["User-Agent"] = USER_AGENT
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        if proxies is not None:
+            self.session.proxies.update(proxies)
+
+    def get(self, url, **kwargs):
+        kwargs.setdefault("timeout", self.timeout)
+        return self.session.get(url, **kwargs)
+
+    def close(self):
+        self.session.close()
+
+
+def configure(pool_size=DEFAULT_POOL_SIZE, timeout=DEFAULT_TIMEOUT, proxies=None):
+    global _client
+    with _client_lock:
+        if _client is not None:
+            _client.close()
+        _client = Client(pool_size, timeout, proxies)
+        return _client
+
+
+def get_client():
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = Client()
+        return _client
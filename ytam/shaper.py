@@ -0,0 +1,150 @@
+import os
+import re
+import time
+import threading
+
+# how many seconds of traffic may go out at once after the transfers were idle
+BURST_SECONDS = 1.0
+# bytes are handed out in pieces no bigger than this, so that every transfer that is waiting gets its turn
+QUANTUM = 64 * 1024
+# how often the control file is checked for a new rate
+POLL_INTERVAL = 1.0
+
+RATE_PATTERN = re.compile(r"^\s*(\d+(?:\.\d+)?)\s*([kmg]?)i?b?(?:/s)?\s*$", re.IGNORECASE)
+UNITS = {"": 1, "k": 1024, "m": 1024 ** 2, "g": 1024 ** 3}
+
+_bucket = None
+_bucket_lock = threading.Lock()
+
+
+def parse_rate(string):
+    """Reads a rate in bytes per second, such as 500K, 2M or 1.5MB/s. 0, "none" and "off" mean no limit and
+    come back as None. Raises ValueError for anything else."""
+    if string.strip().lower() in ("", "none", "off"):
+        return None
+    match = RATE_PATTERN.match(string)
+    if match is None:
+        raise ValueError(f"{string!r} is not a rate, such as 500K or 2M")
+    rate = int(float(match.group(1)) * UNITS[match.group(2).lower()])
+    return rate if rate > 0 else None
+
+
+class TokenBucket:
+    """Caps the bytes per second of every transfer that takes its bytes from it, together.
+
+    The bucket holds up to BURST_SECONDS worth of bytes, so a transfer that starts after a quiet spell goes at
+    full speed for a moment. After that, every QUANTUM bytes wait their turn behind the ones asked for before
+    them: tracks that download at the same time take turns, and share the rate between them evenly. The rate
+    can be changed, or lifted with None, while transfers are running.
+    """
+
+    def __init__(self, rate=None):
+        self.lock = threading.Lock()
+        self.rate = None
+        self.tokens = 0.0
+        self.updated = time.monotonic()
+        self.on_change = None
+        self.set_rate(rate)
+
+    def _refill(self, now):
+        if self.rate is not None:
+            self.tokens = min(self.rate * BURST_SECONDS, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def set_rate(self, rate):
+        with self.lock:
+            self._refill(time.monotonic())
+            # a bucket that wasn't limiting anything starts out full
+            full = self.rate is None
+            self.rate = rate
+            if rate is None:
+                self.tokens = 0.0
+            else:
+                self.tokens = rate * BURST_SECONDS if full else min(self.tokens, rate * BURST_SECONDS)
+            on_change = self.on_change
+        if on_change is not None:
+            on_change(rate)
+
+    def take(self, n):
+        # blocks until n bytes may go through
+        while n > 0:
+            piece = min(n, QUANTUM)
+            n -= piece
+            with self.lock:
+                if self.rate is None:
+                    return
+                self._refill(time.monotonic())
+                # bytes are lent against the bucket: the deficit is what everyone asking later has to wait out
+                self.tokens -= piece
+                wait = -self.tokens / self.rate if self.tokens < 0 else 0.0
+            if wait > 0:
+                time.sleep(wait)
+
+
+class ControlFile:
+    """Watches a file that holds a rate (as --max-rate takes it) and applies it to a bucket whenever the file
+    changes, so that the rate of a run can be changed without restarting it. check(force=True) reads it again
+    straight away. A file that can't be read or parsed leaves the rate as it is."""
+
+    def __init__(self, path, bucket, interval=POLL_INTERVAL):
+        self.path = path
+        self.bucket = bucket
+        self.interval = interval
+        self.mtime = None
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def check(self, force=False):
+        try:
+            mtime = os.path.getmtime(self.path)
+            if mtime == self.mtime and not force:
+                return
+            self.mtime = mtime
+            with open(self.path, "r") as f:
+                rate = parse_rate(f.read())
+        except (OSError, ValueError):
+            return
+        if rate != self.bucket.rate:
+            self.bucket.set_rate(rate)
+
+    def _run(self):
+        while not self.stop_event.wait(self.interval):
+            self.check()
+
+    def start(self):
+        self.check()
+        self.thread = threading.Thread(target=self._run, name="ytam-rate", daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join()
+
+
+def configure(rate):
+    global _bucket
+    with _bucket_lock:
+        _bucket = TokenBucket(rate)
+        return _bucket
+
+
+def get_bucket():
+    return _bucket
+
+
+def shaping():
+    # once a bucket is configured every transfer has to go through it, even while its rate is lifted
+    return _bucket is not None
+
+
+def limiting():
+    return _bucket is not None and _bucket.rate is not None
+
+
+def throttle(n):
+    # every transfer calls this for the bytes it has just received; a no-op unless a rate has been configured
+    bucket = _bucket
+    if bucket is not None:
+        bucket.take(n)
@@ -0,0 +1,74 @@
+import os
+
+try:
+    import error
+except ModuleNotFoundError:
+    import ytam.error as error
+
+PART_SUFFIX = ".part"
+# what a download that can be resumed keeps about the .part file it is writing, next to it
+STATE_SUFFIX = ".json"
+
+
+def part_path(path):
+    return f"{path}{PART_SUFFIX}"
+
+
+def state_path(tmp):
+    return f"{tmp}{STATE_SUFFIX}"
+
+
+def remove(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def preallocate(path, size):
+    """Makes the file at path exactly size bytes long, keeping whatever it already holds, and reserves its blocks
+    up front where the filesystem allows it, so that the file is laid out in one piece instead of growing (and
+    fragmenting) one chunk at a time."""
+    with open(path, "r+b" if os.path.exists(path) else "wb") as f:
+        f.truncate(size)
+        if size > 0 and hasattr(os, "posix_fallocate"):
+            try:
+                os.posix_fallocate(f.fileno(), 0, size)
+            except OSError:
+                # some filesystems can't (older tmpfs, many network mounts); the file is left sparse there
+                pass
+
+
+def sync_dir(path):
+    # a rename is only durable once the directory that holds the file is flushed too. Windows can't open one
+    if not hasattr(os, "O_DIRECTORY"):
+        return
+    fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY | os.O_DIRECTORY)
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def commit(tmp, path, size=None):
+    """Moves a finished file from tmp to path. The file is flushed to disk and, if size is given, checked to be
+    exactly that long before it is renamed, so a file at path is always complete, even after a crash or a power
+    cut. Raises error.SizeMismatchError, leaving tmp where it is, if the size is wrong. Whatever was kept to resume
+    the download of tmp is removed once it is in place."""
+    with open(tmp, "r+b") as f:
+        os.fsync(f.fileno())
+    if size is not None:
+        actual = os.path.getsize(tmp)
+        if actual != size:
+            raise error.SizeMismatchError(tmp, actual, size)
+    os.replace(tmp, path)
+    sync_dir(path)
+    remove(state_path(tmp))
+
+
+def discard(tmp):
+    # the resume state goes too; left on its own it would describe a file that is no longer there
+    remove(tmp)
+    remove(state_path(tmp))
@@ -0,0 +1,128 @@
+import base64
+import threading
+
+import mutagen
+from mutagen.flac import Picture
+from mutagen.mp4 import MP4, MP4Cover
+from mutagen.id3 import ID3, ID3NoHeaderError, TALB, TIT2, TPE1, TRCK, APIC
+
+try:
+    from artcache import is_png
+except ImportError:
+    from ytam.artcache import is_png
+
+
+class TagJob:
+    def __init__(self, path, track_num, total, album, title, artist, image=None, image_digest=None):
+        self.path = path
+        self.track_num = track_num
+        self.total = total
+        self.album = album
+        self.title = title
+        self.artist = artist
+        self.image = image
+        self.image_digest = image_digest
+
+
+class Tagger:
+    """Writes title, artist, album, track number and cover art to mp4/m4a (MP4 atoms), mp3 (ID3) and opus/ogg
+    (Vorbis comments) files.
+
+    A Tagger is safe to share between threads; the tag stage of the download pipeline runs it from a pool of
+    workers fed by a bounded queue. Covers are wrapped as MP4Cover/APIC/METADATA_BLOCK_PICTURE once per distinct
+    image and reused for every track that carries them.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.mp4_covers = {}
+        self.id3_covers = {}
+        self.vorbis_covers = {}
+
+    def _cached(self, cache, job, make):
+        if job.image_digest is None:
+            return make(job.image)
+        with self.lock:
+            cover = cache.get(job.image_digest)
+            if cover is None:
+                cover = cache[job.image_digest] = make(job.image)
+            return cover
+
+    def mp4_cover(self, job):
+        def make(image):
+            image_format = MP4Cover.FORMAT_PNG if is_png(image) else MP4Cover.FORMAT_JPEG
+            return MP4Cover(image, imageformat=image_format)
+
+        return self._cached(self.mp4_covers, job, make)
+
+    def id3_cover(self, job):
+        def make(image):
+            mime = "image/png" if is_png(image) else "image/jpeg"
+            return APIC(encoding=3, mime=mime, type=3, desc="Cover", data=image)
+
+        return self._cached(self.id3_covers, job, make)
+
+    def vorbis_cover(self, job):
+        def make(image):
+            picture = Picture()
+            picture.type = 3
+            picture.mime = "image/png" if is_png(image) else "image/jpeg"
+            picture.desc = "Cover"
+            picture.data = image
+            return base64.b64encode(picture.write()).decode("ascii")
+
+        return self._cached(self.vorbis_covers, job, make)
+
+    def tag(self, job):
+        if job.path.endswith(".mp3"):
+            self.tag_mp3(job)
+        elif job.path.endswith((".opus", ".ogg")):
+            self.tag_ogg(job)
+        else:
+            self.tag_mp4(job)
+
+    def tag_mp4(self, job):
+        song = MP4(job.path)
+        song["\xa9alb"] = job.album
+        song["\xa9nam"] = job.title
+        song["\xa9ART"] = job.artist
+        song["trkn"] = [(job.track_num, job.total)]
+
+        if job.image is not None:
+            song["covr"] = [self.mp4_cover(job)]
+        elif "covr" in song:
+            # a file copied from another album keeps that album's cover otherwise
+            del song["covr"]
+
+        song.save()
+
+    def tag_mp3(self, job):
+        try:
+            song = ID3(job.path)
+        except ID3NoHeaderError:
+            song = ID3()
+        song.add(TALB(encoding=3, text=job.album))
+        song.add(TIT2(encoding=3, text=job.title))
+        song.add(TPE1(encoding=3, text=job.artist))
+        song.add(TRCK(encoding=3, text=f"{job.track_num}/{job.total}"))
+
+        song.delall("APIC")
+        if job.image is not None:
+            song.add(self.id3_cover(job))
+
+        song.save(job.path)
+
+    def tag_ogg(self, job):
+        # mutagen works out from the stream whether it is Ogg Opus or Ogg Vorbis
+        song = mutagen.File(job.path)
+        song["album"] = job.album
+        song["title"] = job.title
+        song["artist"] = job.artist
+        song["tracknumber"] = f"{job.track_num}/{job.total}"
+
+        if job.image is not None:
+            song["metadata_block_picture"] = [self.vorbis_cover(job)]
+        elif "metadata_block_picture" in song:
+            del song["metadata_block_picture"]
+
+        song.save()
@@ -1,5 +1,7 @@
 import os
 import re
+import csv
+import json
 
 try:
     import error
@@ -7,66 +9,209 @@ except ModuleNotFoundError:
     import ytam.error as error
 
 DELIM = "<@>"
+# the fields of a line, in the order they are given in the <@> and CSV formats and named in the JSON lines one
+FIELDS = ("title", "artist", "album", "image")
+CSV_EXTS = (".csv",)
+JSON_EXTS = (".jsonl", ".ndjson")
+# a JSON array of the same objects
+JSON_ARRAY_EXTS = (".json",)
+# what may come between two elements of a JSON array that is known to be valid
+SEPARATOR = re.compile(r"[\s,]*")
 
 
 class Title:
+    """The metadata a titles file gives the song at position index of the playlist. A Title whose title is empty
+    is unused: the song keeps its own title.
+    """
+
+    __slots__ = ("index", "title", "artist", "album", "image_path")
+
     def __init__(self, index, title, artist, album, image_path):
-        self.unused = False
         self.index = index
         self.title = title
         self.artist = artist
         self.album = album
         self.image_path = image_path
 
+    @property
+    def unused(self):
+        return self.title == ""
+
+
+class Titles:
+    """The lines of a titles file, indexed by the position in the playlist of the song each one is for.
+
+    Lines are kept as they were read and only made into a Title when they are looked up, so a file with tens of
+    thousands of lines costs little more than its text, and the Downloader, which only ever looks up the songs it
+    downloads, builds no Title for any other line.
+    """
+
+    def __init__(self, generator, lines, split):
+        self.generator = generator
+        self.lines = lines
+        # line -> its fields, in the order of FIELDS
+        self.split = split
+
+    def __len__(self):
+        return len(self.lines)
+
+    def __getitem__(self, index):
+        return self.generator.make_title(index, self.split(self.lines[index]))
+
+    def __iter__(self):
+        for i in range(len(self.lines)):
+            yield self[i]
+
+
+def entry_fields(entry):
+    # the fields of a JSON lines entry up to the last one given, as they would be written with <@>
+    if entry is None:
+        return [""]
+    fields = [str(entry.get(field) or "") for field in FIELDS]
+    while len(fields) > 1 and fields[-1] == "":
+        fields.pop()
+    return fields
+
+
+def json_fields(line):
+    return entry_fields(json.loads(line) if line != "" else None)
+
 
 class TitleGenerator:
+    """Reads a titles file: one line per song, either title<@>artist... or, for files ending in .csv, the same
+    fields as CSV (after an optional header row naming at least two of them), or, for .jsonl/.ndjson, one JSON
+    object per line with the keys title, artist, album and image, or, for .json, an array of such objects.
+
+    The file is read a line at a time and checked as a whole, so that a bad line is reported with its line number
+    before anything is downloaded; making Titles out of the lines is left to the lookups (see Titles).
+    """
+
     def __init__(self, filename, artist, no_album=False):
         self.filename = filename
         self.artist = artist
         self.no_album = no_album
         self.titles = []
 
-    def check_line(self, line, line_num):
+    def check_line(self, fields, line_num):
+        # fields is how many fields the line has; line_num counts from 1
         if not self.no_album:
-            if not (len(line) > 0 and len(line) < 3):
+            if not (fields > 0 and fields < 3):
                 msg = "wrong number of fields - only title and artist allowed"
-                raise error.BadTitleFormatError(self.filename, line_num + 1, msg)
+                raise error.BadTitleFormatError(self.filename, line_num, msg)
         else:
-            if len(line) < 3:
+            if fields < 3:
                 msg = "wrong number of fields - title, artist and album required"
-                raise error.BadTitleFormatError(self.filename, line_num + 1, msg)
+                raise error.BadTitleFormatError(self.filename, line_num, msg)
 
-    def make_titles(self):
+    def check_counts(self, counts, line_nums=None):
+        # min and max go through every line without a Python loop; check_line only runs when one of them is bad
+        if len(counts) == 0 or (min(counts) >= 3 if self.no_album else max(counts) < 3):
+            return
+        for i, count in enumerate(counts):
+            self.check_line(count, i + 1 if line_nums is None else line_nums[i])
+
+    def make_title(self, index, fields):
+        fields = [field.strip() for field in fields[:len(FIELDS)]]
+        if not self.no_album:
+            return Title(index, fields[0], fields[1] if len(fields) == 2 else self.artist.strip(), None, None)
+        image_path = fields[3] if len(fields) == 4 and fields[3] != "" else None
+        return Title(index, fields[0], fields[1], fields[2], image_path)
+
+    def read_delimited(self, f):
+        lines = [line.strip() for line in f]
+        self.check_counts([line.count(DELIM) + 1 for line in lines])
+        return Titles(self, lines, lambda line: line.split(DELIM))
+
+    def read_csv(self, f):
+        reader = csv.reader(f)
+        rows = []
+        line_nums = []
+        # a quoted field can span lines, so a row starts on the line after the one the row before it ended on
+        start = 1
+        for row in reader:
+            if start == 1 and len(row) >= 2 and [field.strip().lower() for field in row] == list(FIELDS[:len(row)]):
+                # a header row, which stands for no song. A single column is always a title, since a song may well
+                # be called "Title"
+                start = reader.line_num + 1
+                continue
+            rows.append(row if len(row) > 0 else [""])
+            line_nums.append(start)
+            start = reader.line_num + 1
+        self.check_counts([len(row) for row in rows], line_nums)
+        return Titles(self, rows, lambda row: row)
+
+    def read_json(self, f):
+        lines = [line.strip() for line in f]
+        # the whole file is parsed as one array, which is several times faster than parsing it line by line. It is
+        # only parsed line by line, to find the line at fault, when that fails
+        try:
+            entries = json.loads("[" + ",".join(line if line != "" else "null" for line in lines) + "]")
+        except ValueError:
+            entries = None
+        if entries is None or len(entries) != len(lines):
+            for n, line in enumerate(lines, start=1):
+                try:
+                    json.loads(line if line != "" else "null")
+                except ValueError as e:
+                    raise error.BadTitleFormatError(self.filename, n, f"not valid JSON - {e}")
+
+        self.check_entries(entries)
+        return Titles(self, lines, json_fields)
+
+    def check_entries(self, entries, line_nums=None):
+        # line_nums(), if given, returns the line each entry starts on, for entries that aren't one per line
+        known = set(FIELDS)
+        for i, entry in enumerate(entries):
+            if entry is None or isinstance(entry, dict) and entry.keys() <= known:
+                continue
+            n = i + 1 if line_nums is None else line_nums()[i]
+            if not isinstance(entry, dict):
+                raise error.BadTitleFormatError(self.filename, n, "not a JSON object")
+            msg = f"unknown field {sorted(entry.keys() - known)[0]!r} - only {', '.join(FIELDS)} allowed"
+            raise error.BadTitleFormatError(self.filename, n, msg)
+        counts = [len(entry_fields(entry)) for entry in entries]
+        self.check_counts(counts, None if line_nums is None or len(counts) == 0 else line_nums())
+
+    def read_json_array(self, f):
+        text = f.read()
+        if not text.lstrip().startswith("["):
+            # JSON lines after all
+            return self.read_json(text.splitlines())
         try:
-            with open(self.filename, "r") as f:
-                lines = f.readlines()
-
-                for i, line in enumerate(lines):
-                    line = line.strip()
-                    line = re.split(DELIM, line)
-                    self.check_line(line, i)
-
-                    t = Title(i, None, None, None, None)
-                    if line[0] == "":
-                        t.unused = True
-
-                    if not self.no_album:
-                        if len(line) == 1:
-                            t.title = line[0].strip()
-                            t.artist = self.artist.strip()
-                        elif len(line) == 2:
-                            t.title = line[0].strip()
-                            t.artist = line[1].strip()
-                    else:
-                        t.title = line[0]
-                        t.artist = line[1]
-                        t.album = line[2]
-
-                        if len(line) == 4:
-                            t.image_path = line[3]
-
-                    self.titles.append(t)
+            entries = json.loads(text)
+        except ValueError as e:
+            raise error.BadTitleFormatError(self.filename, getattr(e, "lineno", 1), f"not valid JSON - {e}")
+
+        def line_nums():
+            # only worked out to report a bad entry
+            decoder = json.JSONDecoder()
+            nums = []
+            pos = text.index("[") + 1
+            while True:
+                pos = SEPARATOR.match(text, pos).end()
+                if text[pos] == "]":
+                    return nums
+                nums.append(text.count("\n", 0, pos) + 1)
+                pos = decoder.raw_decode(text, pos)[1]
+
+        self.check_entries(entries, line_nums)
+        return Titles(self, entries, entry_fields)
+
+    def make_titles(self):
+        ext = os.path.splitext(self.filename)[1].lower()
+        if ext in CSV_EXTS:
+            read = self.read_csv
+        elif ext in JSON_EXTS:
+            read = self.read_json
+        elif ext in JSON_ARRAY_EXTS:
+            read = self.read_json_array
+        else:
+            read = self.read_delimited
 
+        try:
+            # the csv module reads line breaks inside quoted fields itself
+            with open(self.filename, "r", newline="" if read == self.read_csv else None) as f:
+                self.titles = read(f)
         except FileNotFoundError:
             raise error.TitlesNotFoundError(self.filename)
 
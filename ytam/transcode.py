@@ -0,0 +1,89 @@
+import subprocess
+import tempfile
+
+try:
+    import error
+    import staging
+except ModuleNotFoundError:
+    import ytam.error as error
+    import ytam.staging as staging
+
+FFMPEG = "ffmpeg"
+
+
+def stream_to(chunks, path, muxer="mp3", codec_args=(), executable=FFMPEG):
+    """Writes the audio in chunks (an iterable of bytes) to path in the format of the given ffmpeg muxer, by
+    piping it through ffmpeg's stdin. codec_args say how: ["-c:a", "copy"] to remux it as it is, or the encoder
+    to use (ffmpeg's default for the muxer if empty).
+
+    Writes to the pipe block while ffmpeg is busy, so the download never runs further ahead of the encoder than
+    the pipe buffer. The file is written to <path>.part and only moved to path once ffmpeg has finished; if
+    anything goes wrong the partial file is removed.
+    """
+    part = staging.part_path(path)
+    with tempfile.TemporaryFile() as log:
+        process = subprocess.Popen(
+            [executable, "-y", "-loglevel", "error", "-i", "pipe:0", "-vn", *codec_args, "-f", muxer, part],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.DEVNULL,
+            stderr=log,
+        )
+        try:
+            try:
+                for chunk in chunks:
+                    process.stdin.write(chunk)
+                process.stdin.close()
+            except BrokenPipeError:
+                # ffmpeg gave up before the end of the stream; its exit status and log say why
+                pass
+            returncode = process.wait()
+        except BaseException:
+            process.kill()
+            process.wait()
+            staging.discard(part)
+            raise
+
+        if returncode != 0:
+            log.seek(0)
+            message = log.read().decode("utf8", errors="replace").strip().splitlines()
+            staging.discard(part)
+            raise error.TranscodeError(returncode, message[-1] if len(message) > 0 else "")
+        staging.commit(part, path)
+
+
+def convert(src, dst, muxer="mp3", codec_args=(), on_progress=None, executable=FFMPEG):
+    """Writes the audio of the file at src to dst in the format of the given ffmpeg muxer, remuxed or encoded as
+    codec_args say (see stream_to). on_progress(seconds) is called with how much of the audio has been written
+    so far, as ffmpeg reports it on its -progress channel. Like stream_to, it only ever leaves a complete file
+    at dst.
+    """
+    part = staging.part_path(dst)
+    with tempfile.TemporaryFile() as log:
+        process = subprocess.Popen(
+            [
+                executable, "-y", "-loglevel", "error", "-nostats", "-progress", "pipe:1", "-i", src, "-vn",
+                *codec_args, "-f", muxer, part,
+            ],
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.PIPE,
+            stderr=log,
+        )
+        try:
+            for line in process.stdout:
+                key, _, value = line.decode("utf8", errors="replace").strip().partition("=")
+                # out_time_ms is in microseconds too; older ffmpeg builds only report that one
+                if key in ("out_time_us", "out_time_ms") and value.isdigit() and on_progress is not None:
+                    on_progress(int(value) / 1000000.0)
+            returncode = process.wait()
+        except BaseException:
+            process.kill()
+            process.wait()
+            staging.discard(part)
+            raise
+
+        if returncode != 0:
+            log.seek(0)
+            message = log.read().decode("utf8", errors="replace").strip().splitlines()
+            staging.discard(part)
+            raise error.TranscodeError(returncode, message[-1] if len(message) > 0 else "")
+        staging.commit(part, dst)
@@ -1,6 +1,18 @@
-import pkg_resources
-
 try:
-    version = pkg_resources.require("ytam")[0].version
-except pkg_resources.DistributionNotFound:
-    version = "dev"
+    from importlib import metadata
+except ImportError:
+    # Python < 3.8, where pkg_resources is the only way to ask
+    metadata = None
+
+if metadata is not None:
+    try:
+        version = metadata.version("ytam")
+    except metadata.PackageNotFoundError:
+        version = "dev"
+else:
+    import pkg_resources
+
+    try:
+        version = pkg_resources.require("ytam")[0].version
+    except pkg_resources.DistributionNotFound:
+        version = "dev"
@@ -1,24 +1,56 @@
 import os
 import re
-import requests
-import asyncio
+import time
+import sqlite3
+import threading
+import functools
 
-from pytube import YouTube
-from mutagen.mp4 import MP4, MP4Cover
-
-from ffmpeg import FFmpeg
+from pytube import YouTube, Playlist
 
 try:
     import error
     import font
     from title import TitleGenerator
+    from console import TrackConsole
+    from progress import ProgressRenderer, human_bytes
+    from pipeline import Pipeline
+    from prefetch import Prefetcher, DEFAULT_DEPTH
+    from concurrency import AdaptiveLimit, THROTTLE_STATUSES
+    from artcache import ArtCache
+    from tagger import Tagger, TagJob
+    from manifest import open_manifest, extract_video_id
+    from segmented import SegmentedDownload, iter_ranges
+    from resolvecache import CachedStream
+    from transcode import stream_to, convert
+    from formats import FORMATS, DEFAULT_FORMAT, stream_source, choose_stream
+    from library import clone
+    import retry
+    import shaper
+    import staging
 except ModuleNotFoundError:
     import ytam.error as error
     import ytam.font as font
     from ytam.title import TitleGenerator
+    from ytam.console import TrackConsole
+    from ytam.progress import ProgressRenderer, human_bytes
+    from ytam.pipeline import Pipeline
+    from ytam.prefetch import Prefetcher, DEFAULT_DEPTH
+    from ytam.concurrency import AdaptiveLimit, THROTTLE_STATUSES
+    from ytam.artcache import ArtCache
+    from ytam.tagger import Tagger, TagJob
+    from ytam.manifest import open_manifest, extract_video_id
+    from ytam.segmented import SegmentedDownload, iter_ranges
+    from ytam.resolvecache import CachedStream
+    from ytam.transcode import stream_to, convert
+    from ytam.formats import FORMATS, DEFAULT_FORMAT, stream_source, choose_stream
+    from ytam.library import clone
+    import ytam.retry as retry
+    import ytam.shaper as shaper
+    import ytam.staging as staging
 
 URL_EXP = r"(https?://)?[-a-zA-Z0-9@:%._\+~#=]{1,256}\.[a-zA-Z0-9()]{1,6}\b([-a-zA-Z0-9()@:%_\+.~#?&//=]*)"
 URL_PATTERN = re.compile(URL_EXP)
+TAG_WORKERS = 4
 
 
 def make_safe_filename(string):
@@ -49,19 +81,67 @@ def is_url(s):
     return True if URL_PATTERN.match(s) else False
 
 
+def resolve_playlist(url, resolve_cache=None, needed=0):
+    # needed is the number of songs the caller's indices reach; a cached listing that is shorter is from before
+    # songs were added, and is looked up again
+    playlist = Playlist(url)
+    if resolve_cache is None:
+        return playlist.title, list(playlist.video_urls), None
+
+    playlist_id = playlist.playlist_id
+    cached = resolve_cache.get_playlist(playlist_id)
+    if cached is not None and len(cached.video_urls) >= needed:
+        return cached.title, cached.video_urls, playlist_id
+
+    title = playlist.title
+    video_urls = list(playlist.video_urls)
+    resolve_cache.put_playlist(playlist_id, title, video_urls)
+    return title, video_urls, playlist_id
+
+
+class Track:
+    def __init__(self, num, url, song, downloader=None, job=0):
+        self.num = num
+        self.url = url
+        self.song = song
+        # the Downloader whose stages process this track, and a key that is unique across every playlist that
+        # shares a pipeline with it
+        self.downloader = downloader
+        self.key = (job, num)
+        self.video_id = extract_video_id(url)
+        self.video = None
+        self.title = None
+        self.length = None
+        self.path = None
+        self.stages = []
+        self.proxy = None
+        self.proxy_name = None
+        self.first_byte = None
+        self.error = None
+        self.attempt = 1
+        self.claimed = False
+        # stage -> wall time, and bytes moved where there are any, of the stages this track got through
+        self.timings = {}
+
+
+class Failure:
+    def __init__(self, track, kind):
+        self.song = track.song
+        self.url = track.url
+        self.kind = kind
+        self.reason = "unknown error" if track.error is None else (str(track.error) or type(track.error).__name__)
+
+    def as_dict(self):
+        return {"song": self.song, "url": self.url, "kind": self.kind, "reason": self.reason}
+
+
 class Downloader:
     is_album = None
     album_image_set = False
     urls = None
     album = None
-    cur_video = None
     image_filepath = None
     metadata_filepath = None
-    successful = 0
-    cur_song = 1
-    successful_filepaths = []
-    retry_urls = []
-    to_delete = []
     start = None
 
     def __init__(
@@ -77,8 +157,25 @@ class Downloader:
             keep_images,
             proxies,
             mp3,
+            jobs=1,
+            art_cache=None,
+            resume=True,
+            connections=None,
+            resolve_cache=None,
+            stream=False,
+            proxy_pool=None,
+            metrics=None,
+            library=None,
+            prefetch=DEFAULT_DEPTH,
+            max_jobs=None,
+            output_format=None,
+            tag_workers=TAG_WORKERS,
     ):
         self.urls = urls
+        self.successful = 0
+        self.successful_filepaths = []
+        self.retry_urls = []
+        self.job = 0
         self.total_songs = total_songs
         self.album = album
         self.is_album = is_album
@@ -89,218 +186,666 @@ class Downloader:
         self.keep_images = keep_images
         self.images = []
         self.proxies = proxies
-        self.mp3 = mp3
-
-    def progress_function(self, chunk, chunk_size, bytes_remaining):
-        title = self.cur_video.title
-        size = self.cur_video.filesize
-        p = ((size - bytes_remaining) * 100.0) / size
-        progress = (
-            f"Downloading song {font.apply('gb', str(self.cur_song)) + ' - ' + font.apply('gb', title)} - [{p:.2f}%]"
-            if p < 100
-            else f"Downloading song {font.apply('gb', str(self.cur_song)) + ' - ' + font.apply('gb', title)} -"
-                 f" {font.apply('bl', '[Done]          ')}"
+        self.proxy_pool = proxy_pool
+        self.metrics = metrics
+        self.library = library
+        # how many tracks ahead of the download workers streams and album art are looked up; 0 turns it off
+        self.prefetch = prefetch
+        self.prefetcher = None
+        # the number of songs downloaded at the same time starts at jobs and adapts to the throughput YouTube
+        # allows, up to max_jobs
+        self.max_jobs = max_jobs
+        self.concurrency = None
+        self.attempts = {}
+        # pytube installs its proxies for the whole process, so with a pool a stream is resolved and its proxy
+        # installed by one track at a time
+        self.resolve_lock = threading.Lock()
+        # the format songs are left in (see formats.FORMATS); mp3 is shorthand for output_format="mp3"
+        self.output = FORMATS[output_format if output_format is not None else "mp3" if mp3 else DEFAULT_FORMAT]
+        self.converting = self.output.name != DEFAULT_FORMAT
+        self.jobs = jobs
+        self.metadata = None
+        self.console = None
+        self.progress = None
+        self.art_cache = ArtCache() if art_cache is None else art_cache
+        self.tagger = Tagger()
+        self.tag_workers = tag_workers
+        self.resume = resume
+        self.connections = connections
+        self.resolve_cache = resolve_cache
+        # streaming only changes anything when converting. Songs are converted before they are tagged, so that
+        # the tags are written in the format they end up in
+        self.stream = stream and self.converting
+        self.tag_branch = "└──"
+        self.convert_branch = "├──"
+        self.manifest = None
+        # song number -> Failure for every track that is still failing, whether or not it will be retried
+        self.failures = {}
+        # called with every track as it leaves the pipeline, done or not
+        self.on_track_done = None
+        self.pipeline = None
+        self.cancelled = False
+
+    def log(self, track, text):
+        self.console.write(track.key, text)
+
+    def progress_function(self, track, stream, chunk, bytes_remaining):
+        # runs for every chunk, so all it does is update the counters that self.progress draws from
+        if track.first_byte is None:
+            track.first_byte = time.monotonic()
+        self.progress.set_bytes(track.key, stream.filesize - bytes_remaining)
+
+    def downloaded(self, track):
+        self.log(
+            track,
+            f"Downloading song {font.apply('gb', str(track.song)) + ' - ' + font.apply('gb', track.title)} -"
+            f" {font.apply('bl', '[Done]')}"
         )
 
-        end = "\n" if p == 100 else "\r"
-
-        print(progress, end=end, flush=True)
-
-    @staticmethod
-    def apply_metadata(
-            track_num, total, path, album, title, artist, image_filename
-    ):
-        song = MP4(path)
-        song["\xa9alb"] = album
-        song["\xa9nam"] = title
-        song["\xa9ART"] = artist
-        song["trkn"] = [(track_num, total)]
-
-        if image_filename is not None:
-            with open(image_filename, "rb") as f:
-                song["covr"] = [MP4Cover(f.read(), imageformat=MP4Cover.FORMAT_JPEG)]
-
-        song.save()
-
-    @staticmethod
-    def download_image(url, index, outdir):
-        thumbnail_image = requests.get(url)
-        if len(thumbnail_image.content) == 0:
-            raise error.ImageDownloadError(url)
-
-        filename = outdir + f"album_art_{str(index)}.jpg"
-        with open(filename, "wb") as f:
-            f.write(thumbnail_image.content)
-        return filename
-
-    def download(self):
-        metadata = None
-        track_image_path = None
+    def skipped(self, track, branch, text):
+        self.log(track, f"{branch} {text} - {font.apply('bl', '[Already done]')}")
+
+    def resume_track(self, track):
+        # picks up whatever a previous run already finished for this track, as long as its file is still intact
+        entry = self.manifest.verify(track.video_id) if self.resume else None
+        if entry is None:
+            return
+        kept_as_is = "converted" in entry["stages"] or not self.converting
+        if kept_as_is and not entry["path"].endswith(f".{self.output.ext}"):
+            # left in another format by a run with other options, such as a webm downloaded to be made into opus. A
+            # file that was only downloaded can still be converted into whatever this run wants
+            return
+
+        track.stages = list(entry["stages"])
+        track.path = entry["path"]
+        track.title = entry.get("title")
+        track.length = entry.get("length")
+
+    def audio_stream(self, yt):
+        if not self.converting:
+            return (
+                yt.streams.filter(type="audio", subtype="mp4")
+                    .order_by("abr")
+                    .desc()
+                    .first()
+            )
+        return choose_stream(yt.streams.filter(type="audio"), self.output)
+
+    def library_exts(self):
+        # a song kept as it was downloaded can still be converted, which beats downloading it again
+        return (self.output.ext,) if not self.converting else (self.output.ext, DEFAULT_FORMAT)
+
+    def measure(self, track, stage, started, nbytes=None, **info):
+        seconds = time.monotonic() - started
+        timing = {"seconds": round(seconds, 4)}
+        if nbytes is not None:
+            timing["bytes"] = nbytes
+            timing["mb_per_s"] = round(nbytes / (1024 * 1024) / seconds, 3) if seconds > 0 else None
+        timing.update(info)
+        track.timings[stage] = timing
+
+    def take_proxy(self, track):
+        # blocks until a healthy proxy has room for one more stream
+        if self.proxy_pool is not None:
+            track.proxy = self.proxy_pool.acquire()
+            track.proxy_name = track.proxy.name
+            track.first_byte = None
+        return time.monotonic()
+
+    def return_proxy(self, track, ok, started):
+        if track.proxy is None:
+            return
+        # latency runs up to the first byte of audio, throughput from there on
+        latency = None if track.first_byte is None else track.first_byte - started
+        seconds = time.monotonic() - (started if track.first_byte is None else track.first_byte)
+        size = track.video.filesize if ok else 0
+        if not ok and (track.error is None or retry.classify(track.error) != retry.TRANSIENT):
+            # a video that is private, removed or blocked fails the same way through any proxy
+            ok = None
+        self.proxy_pool.release(track.proxy, ok, nbytes=size, seconds=seconds, latency=latency)
+        track.proxy = None
+
+    def transfer_done(self, track, ok, started):
+        # tells the concurrency limit and the proxy pool how the track's transfer went
+        if self.concurrency is not None:
+            status = retry.http_status(track.error) if track.error is not None else None
+            if ok and not shaper.limiting():
+                # while the rate is capped, slow streams say nothing about YouTube and the cap leaves nothing for
+                # more streams to gain
+                since = started if track.first_byte is None else track.first_byte
+                self.concurrency.finished(track.video.filesize, time.monotonic() - since, started)
+            elif status in THROTTLE_STATUSES:
+                self.concurrency.throttled(status, started)
+        self.return_proxy(track, ok, started)
+
+    def concurrency_changed(self, limit, reason):
+        self.progress.println(f"Downloading {font.apply('gb', str(limit))} songs at a time - {reason}")
+        if self.metrics is not None:
+            self.metrics.event("concurrency", limit=limit, reason=reason)
+
+    def rate_changed(self, rate):
+        if rate is None:
+            self.progress.println("Download rate no longer limited")
+        else:
+            self.progress.println(f"Download rate limited to {font.apply('gb', human_bytes(rate) + '/s')}")
+        if self.metrics is not None:
+            self.metrics.event("rate", limit=rate)
+
+    def from_library(self, track):
+        # copies the track from wherever an earlier run already finished it, instead of downloading it again.
+        # When another track in this process is fetching the same video, waits for it to finish first
+        if self.library is None or not self.resume:
+            return False
+
+        waiting = self.library.claim(track.video_id)
+        if waiting is not None:
+            waiting.wait()
+        else:
+            track.claimed = True
 
-        asyncio.set_event_loop(asyncio.new_event_loop())
-        loop = asyncio.get_event_loop()
+        try:
+            entry = self.library.get(track.video_id, self.library_exts())
+            if entry is None:
+                return False
 
-        if self.metadata_filepath is not None:
-            if self.is_album:
-                tg = TitleGenerator(self.metadata_filepath, self.artist)
+            started = time.monotonic()
+            path = os.path.join(self.outdir, f"{extract_title(make_safe_filename(entry.title))}.{entry.ext}")
+            if os.path.abspath(path) == entry.path:
+                how = "in place"
             else:
-                tg = TitleGenerator(self.metadata_filepath, self.artist, no_album=True)
-
-            tg.make_titles()
-            metadata = tg.get_titles()
-
-        for num, url in self.urls:
-            yt = None
-            image_dl_failed = False
-            failed_image_url = ""
-            self.cur_song = num + self.start + 1
-            try:
-                if self.proxies is not None:
-                    yt = YouTube(url, proxies=self.proxies)
-                else:
-                    yt = YouTube(url)
-
-            except Exception as e:
-                self.retry_urls.append((num, url))
-                print(
-                    f"Downloading song {font.apply('gb', str(self.cur_song))} - "
+                os.makedirs(self.outdir, exist_ok=True)
+                how = clone(entry.path, path)
+            self.measure(track, "library", started, entry.size, how=how)
+            self.manifest.record(track.video_id, "downloaded", path, title=entry.title, length=entry.length)
+            converted = self.converting and entry.ext == self.output.ext
+            if converted:
+                self.manifest.record(track.video_id, "converted", path)
+        except Exception as e:
+            # the claim is still released by finish_track
+            self.log(
+                track,
+                f"Copying song {font.apply('gb', str(track.song))} from the library - "
+                f"{font.apply('bf', '[Failed - ')} {font.apply('bf', str(e) + ']')} - downloading it instead"
+            )
+            return False
+
+        track.title = entry.title
+        track.length = entry.length
+        track.path = path
+        self.log(
+            track,
+            f"Downloading song {font.apply('gb', str(track.song)) + ' - ' + font.apply('gb', track.title)} -"
+            f" {font.apply('bl', '[From library]')}"
+        )
+        track.stages.append("downloaded")
+        if converted:
+            track.stages.append("converted")
+        return True
+
+    def cover_source(self, track):
+        # the URL or path of the image a track is tagged with, if any
+        if self.metadata is not None and self.metadata[track.num].image_path is not None:
+            return self.metadata[track.num].image_path
+        return self.image_filepath
+
+    def prefetch_track(self, track):
+        # runs on a prefetch thread while the tracks in front of this one are downloading, so that the download
+        # and tag stages find its stream resolved and its cover in the art cache
+        if "tagged" not in track.stages:
+            image_source = self.cover_source(track)
+            if image_source is not None and is_url(image_source):
+                try:
+                    self.art_cache.get(image_source, True)
+                except error.ImageDownloadError:
+                    # the tag stage runs into it again and reports it for the track
+                    pass
+
+        if "downloaded" in track.stages:
+            return None
+        # with a proxy pool the stream has to be resolved through the proxy the track is given when it starts
+        if self.proxy_pool is not None:
+            return None
+        if self.library is not None and self.resume:
+            if self.library.get(track.video_id, self.library_exts()) is not None:
+                return None
+        return self.resolve_stream(track)
+
+    def lookup_stream(self, track):
+        if self.prefetcher is not None:
+            prefetched = self.prefetcher.take(track)
+            if prefetched is not None:
+                return prefetched
+        return self.resolve_stream(track)
+
+    def resolve_stream(self, track):
+        # looks up the audio stream to download, reusing what an earlier run resolved when the cache allows it
+        started = time.monotonic()
+        if self.resolve_cache is not None:
+            cached = self.resolve_cache.get_stream(track.video_id)
+            # a stream resolved for another format may not be the one this format would pick
+            if cached is not None and self.output.prefers(cached):
+                self.measure(track, "resolve", started, cached=True)
+                return cached, cached.length
+
+        if track.proxy is not None:
+            with self.resolve_lock:
+                yt = YouTube(track.url, proxies=track.proxy.proxies)
+                stream = self.audio_stream(yt)
+        else:
+            if self.proxies is not None:
+                yt = YouTube(track.url, proxies=self.proxies)
+            else:
+                yt = YouTube(track.url)
+            stream = self.audio_stream(yt)
+
+        yt.register_on_progress_callback(functools.partial(self.progress_function, track))
+        if self.resolve_cache is not None:
+            self.resolve_cache.put_stream(track.video_id, stream.title, yt.length, stream)
+        self.measure(track, "resolve", started, cached=False)
+        return stream, yt.length
+
+    def stage_download(self, track, path):
+        # pytube's own download() writes straight to the final name, so a crash would leave a truncated file that
+        # looks complete. The stream goes into a preallocated <path>.part instead, which is moved into place once
+        # it has all of its bytes
+        os.makedirs(self.outdir, exist_ok=True)
+        part = staging.part_path(path)
+        staging.preallocate(part, track.video.filesize)
+        try:
+            with open(part, "r+b") as f:
+                track.video.stream_to_buffer(f)
+                f.truncate(f.tell())
+            staging.commit(part, path, track.video.filesize)
+        except BaseException:
+            staging.discard(part)
+            raise
+        return path
+
+    def fetch_track(self, track):
+        # download stage. Everything that is printed goes through self.log so that tracks that are in flight
+        # at the same time still come out in playlist order
+        if "downloaded" in track.stages:
+            song = f"{font.apply('gb', str(track.song)) + ' - ' + font.apply('gb', track.title)}"
+            self.skipped(track, "Downloading song", song)
+            return True
+
+        if self.from_library(track):
+            return True
+
+        started = self.take_proxy(track)
+        try:
+            track.video, track.length = self.lookup_stream(track)
+            track.title = track.video.title
+            self.progress.start_track(track.key, track.song, track.title, track.video.filesize)
+
+            safe_name = extract_title(make_safe_filename(track.title))
+            # saved as .mp4 or .webm, as it was served, until the convert stage puts it in the output format
+            filename = f"{safe_name}.{stream_source(track.video)[0]}"
+            transfer_started = time.monotonic()
+            if (
+                self.connections is not None
+                or isinstance(track.video, CachedStream)
+                or track.proxy is not None
+                or shaper.shaping()
+            ):
+                # a cached stream has no pytube object behind it, pytube can't send one track through one proxy
+                # while another goes through the next, and it reads 9 MB at a time, too much to shape the rate
+                # by, so these are fetched with our own engine
+                path = SegmentedDownload(
+                    track.video.url,
+                    track.video.filesize,
+                    os.path.join(self.outdir, filename),
+                    connections=self.connections or 1,
+                    on_progress=functools.partial(self.progress_function, track, track.video),
+                    proxies=track.proxy.proxies if track.proxy is not None else None,
+                ).run()
+            else:
+                path = self.stage_download(track, os.path.join(self.outdir, filename))
+        except (Exception, KeyboardInterrupt) as e:
+            track.error = e
+            self.transfer_done(track, False, started)
+            if self.resolve_cache is not None:
+                self.resolve_cache.invalidate_stream(track.video_id)
+
+            if track.video is None:
+                self.log(
+                    track,
+                    f"Downloading song {font.apply('gb', str(track.song))} - "
                     f"{font.apply('bf', '[Failed - ')} {font.apply('bf', str(e) + ']')}\n"
                 )
-                continue
-
-            try:
-                yt.register_on_progress_callback(self.progress_function)
-                self.cur_video = (
-                    yt.streams.filter(type="audio", subtype="mp4")
-                        .order_by("abr")
-                        .desc()
-                        .first()
-                )
-
-                safe_name = extract_title(make_safe_filename(self.cur_video.title))
-                path = self.cur_video.download(
-                    output_path=self.outdir, filename=f"{safe_name}.mp4"
-                )
-                self.successful_filepaths.append(path)
-                self.successful += 1
-            except (Exception, KeyboardInterrupt) as e:
-                self.retry_urls.append((num, url))
-                print(
+            else:
+                self.log(
+                    track,
                     f"Downloading song "
-                    f"{font.apply('gb', str(self.cur_song)) + ' - ' + font.apply('gb', self.cur_video.title)} "
+                    f"{font.apply('gb', str(track.song)) + ' - ' + font.apply('gb', track.video.title)} "
                     f"- {font.apply('bf', '[Failed - ')} {font.apply('bf', str(e) + ']')}\n"
                 )
+            return False
+
+        self.transfer_done(track, True, started)
+        self.measure(track, "transfer", transfer_started, track.video.filesize)
+        self.downloaded(track)
+        self.manifest.record(track.video_id, "downloaded", path, title=track.title, length=track.length)
+        track.stages.append("downloaded")
+        track.path = path
+        return True
+
+    def tag_track(self, track):
+        metadata_branch = self.tag_branch
+        if "tagged" in track.stages:
+            self.skipped(track, metadata_branch, "Applying metadata")
+            return True
+
+        image_source = self.cover_source(track)
+        metadata = self.metadata
+
+        if metadata is not None:
+            t = metadata[track.num]
+            track_title = t.title if not t.unused else track.title
+            track_artist = t.artist if not t.unused else self.artist
+            track_album = self.album if self.is_album else t.album
 
-                continue
-
-            if metadata is not None:
-                t = metadata[num]
-                track_title = t.title if not t.unused else self.cur_video.title
-                track_artist = t.artist if not t.unused else self.artist
-                track_album = self.album
-                track_image_path = self.image_filepath
-                if t.image_path is not None:
-                    if not is_url(t.image_path):
-                        track_image_path = t.image_path
-                    else:
-                        try:
-                            track_image_path = Downloader.download_image(
-                                t.image_path, num, self.outdir
-                            )
-                            if not self.keep_images:
-                                self.to_delete.append(track_image_path)
-                        except error.ImageDownloadError:
-                            image_dl_failed = True
-                            failed_image_url = t.image_path
-                else:
-                    if self.image_filepath is not None:
-                        try:
-                            if is_url(self.image_filepath):
-                                track_image_path = Downloader.download_image(
-                                    self.image_filepath, num, self.outdir
-                                )
-                            else:
-                                track_image_path = self.image_filepath
-                            if not self.keep_images:
-                                self.to_delete.append(track_image_path)
-                        except error.ImageDownloadError:
-                            image_dl_failed = True
-                            failed_image_url = self.image_filepath
-
-                if not self.is_album:
-                    track_album = t.album
-
-            else:
-                track_title = self.cur_video.title
-                track_artist = self.artist
-                track_album = self.album
-                if self.image_filepath is not None:
-                    if not is_url(self.image_filepath):
-                        track_image_path = self.image_filepath
-                    else:
-                        try:
-                            track_image_path = Downloader.download_image(
-                                self.image_filepath, num, self.outdir
-                            )
-                            if not self.keep_images:
-                                self.to_delete.append(track_image_path)
-                        except error.ImageDownloadError:
-                            image_dl_failed = True
-                            failed_image_url = self.image_filepath
-
-            metadata_branch = "├──" if self.mp3 else "└──"
-
+        else:
+            track_title = track.title
+            track_artist = self.artist
+            track_album = self.album
+
+        try:
+            job = TagJob(track.path, track.num + 1, self.total_songs, track_album, track_title, track_artist)
+            if image_source is not None:
+                started = time.monotonic()
+                remote = is_url(image_source)
+                job.image_digest, job.image = self.art_cache.get(image_source, remote)
+                if remote and self.keep_images:
+                    self.art_cache.write(job.image_digest, self.outdir)
+                self.measure(track, "art", started)
+
+            started = time.monotonic()
+            self.tagger.tag(job)
+            self.measure(track, "tag", started)
+            self.manifest.record(track.video_id, "tagged", track.path)
+            track.stages.append("tagged")
+            self.log(
+                track, f"{metadata_branch} Applying metadata - {font.apply('bl', '[Done]')}"
+            )
+
+        except (Exception, KeyboardInterrupt) as e:
+            self.log(
+                track,
+                f"{metadata_branch} Applying metadata - {font.apply('bf', '[Failed - ')} "
+                f"{font.apply('bf', str(e) + ']')}"
+            )
+
+        # a track that could not be tagged still counts as downloaded, so it carries on to the next stage
+        return True
+
+    def convert_track(self, track):
+        branch = self.convert_branch
+        output = self.output
+        if "converted" in track.stages:
+            self.skipped(track, branch, f"Converting to {output.name}")
+            return True
+
+        path = track.path
+        dst = f"{extract_title(path)}.{output.ext}"
+        if track.video is not None:
+            codec = stream_source(track.video)[1]
+        else:
+            # resumed or copied from the library. A webm is all but always opus; if it isn't, the remux fails and
+            # the song is encoded instead
+            codec = "opus" if path.endswith(".webm") else "mp4a"
+        copied = output.can_copy(codec)
+        self.progress.start_track(track.key, track.song, track.title, 0)
+
+        # a song whose length isn't known, or is given as 0, is shown converting without a percentage
+        total = int(track.length or 0) or None
+
+        def conv_progress(seconds):
+            p = min((seconds / total) * 100, 100.0) if total is not None else None
+            self.progress.set_stage(track.key, "Converting", p)
+
+        try:
+            started = time.monotonic()
+            size = os.path.getsize(path)
             try:
-                if image_dl_failed:
-                    raise error.ImageDownloadError(failed_image_url)
-
-                self.apply_metadata(
-                    num + 1,
-                    self.total_songs,
-                    path,
-                    track_album,
-                    track_title,
-                    track_artist,
-                    track_image_path,
-                )
-                print(
-                    f"{metadata_branch} Applying metadata - {font.apply('bl', '[Done]')}"
-                )
+                convert(path, dst, output.muxer, output.codec_args(codec), on_progress=conv_progress)
+            except error.TranscodeError:
+                if not copied:
+                    raise
+                copied = False
+                convert(path, dst, output.muxer, output.encode_args, on_progress=conv_progress)
+            self.measure(track, "convert", started, size, remux=copied)
+            done = "Remuxing" if copied else "Converting"
+            self.log(track, f"{branch} {done} to {output.name} - {font.apply('bl', '[Done]')}")
+            if path != dst:
+                os.remove(path)
+            track.path = dst
+            # the new file carries none of the tags a previous run may have written to the old one
+            self.manifest.record(track.video_id, "converted", dst, drop=("tagged",))
+            if "tagged" in track.stages:
+                track.stages.remove("tagged")
+            track.stages.append("converted")
+
+        except (Exception, KeyboardInterrupt) as e:
+            self.log(
+                track,
+                f"{branch} Converting to {output.name} - {font.apply('bf', '[Failed - ')} "
+                f"{font.apply('bf', str(e) + ']')}"
+            )
+
+        return True
+
+    def stream_track(self, track):
+        # download and conversion in one stage: the audio is piped from the network straight into ffmpeg, so
+        # only the converted file is ever written to disk
+        if "downloaded" in track.stages:
+            return self.fetch_track(track) and self.convert_track(track)
+
+        if self.from_library(track):
+            # a library copy that is not in the output format yet is converted here, since streaming has no
+            # conversion stage
+            return self.convert_track(track)
+
+        started = self.take_proxy(track)
+        try:
+            track.video, track.length = self.lookup_stream(track)
+            track.title = track.video.title
+            self.progress.start_track(track.key, track.song, track.title, track.video.filesize)
+
+            safe_name = extract_title(make_safe_filename(track.title))
+            path = os.path.join(self.outdir, f"{safe_name}.{self.output.ext}")
+            os.makedirs(self.outdir, exist_ok=True)
+            transfer_started = time.monotonic()
+            chunks = iter_ranges(
+                track.video.url,
+                track.video.filesize,
+                on_progress=functools.partial(self.progress_function, track, track.video),
+                proxies=track.proxy.proxies if track.proxy is not None else None,
+            )
+            stream_to(chunks, path, self.output.muxer, self.output.codec_args(stream_source(track.video)[1]))
+        except (Exception, KeyboardInterrupt) as e:
+            track.error = e
+            self.transfer_done(track, False, started)
+            if self.resolve_cache is not None:
+                self.resolve_cache.invalidate_stream(track.video_id)
+            video_title = track.video.title if track.video is not None else ""
+            self.log(
+                track,
+                f"Downloading song "
+                f"{font.apply('gb', str(track.song)) + ' - ' + font.apply('gb', video_title)} "
+                f"- {font.apply('bf', '[Failed - ')} {font.apply('bf', str(e) + ']')}\n"
+            )
+            return False
+
+        self.transfer_done(track, True, started)
+        self.measure(track, "stream", transfer_started, track.video.filesize)
+        self.downloaded(track)
+        self.log(track, f"{self.convert_branch} Converting to {self.output.name} - {font.apply('bl', '[Done]')}")
+        self.manifest.record(track.video_id, "downloaded", path, title=track.title, length=track.length)
+        self.manifest.record(track.video_id, "converted", path)
+        track.stages += ["downloaded", "converted"]
+        track.path = path
+        return True
+
+    def stage_failed(self, track, name, e):
+        # a stage raised instead of reporting the failure itself
+        track.error = e
+        self.log(
+            track,
+            f"Song {font.apply('gb', str(track.song))} - {name} stage "
+            f"{font.apply('bf', '[Failed - ')} {font.apply('bf', (str(e) or type(e).__name__) + ']')}\n"
+        )
 
-            except (Exception, KeyboardInterrupt) as e:
-                print(
-                    f"{metadata_branch} Applying metadata - {font.apply('bf', '[Failed - ')} "
-                    f"{font.apply('bf', str(e) + ']')}"
+    def finish_track(self, track):
+        try:
+            self.record_track(track)
+        finally:
+            # whatever went wrong above, the tracks after this one must still get to print
+            self.progress.finish_track(track.key)
+            self.console.finish(track.key)
+        if self.prefetcher is not None:
+            self.prefetcher.discard(track)
+        if self.metrics is not None:
+            self.metrics.track(track, self.outdir)
+        if self.on_track_done is not None:
+            self.on_track_done(track)
+
+    def record_track(self, track):
+        # the library is updated before the track is finished, so that a failure to do so is still printed with the
+        # rest of the track
+        if self.library is not None:
+            try:
+                if track.path is not None:
+                    # the manifest's last record is of the file as it was left, so its hash doesn't need recomputing
+                    entry = self.manifest.get(track.video_id)
+                    done = entry is not None and entry.get("path") == track.path
+                    self.library.add(
+                        track.video_id,
+                        track.path,
+                        track.title,
+                        track.length,
+                        entry.get("size") if done else None,
+                        entry.get("sha256") if done else None,
+                    )
+            except FileNotFoundError:
+                # the file went missing after it was finished; it simply isn't offered to later playlists
+                pass
+            except (OSError, sqlite3.Error) as e:
+                # such as "database is locked" while another ytam run writes to the same library
+                self.log(
+                    track,
+                    f"Adding song {font.apply('gb', str(track.song))} to the library - "
+                    f"{font.apply('bf', '[Failed - ')} {font.apply('bf', str(e) + ']')}"
                 )
+            finally:
+                if track.claimed:
+                    self.library.release(track.video_id)
+        if track.path is not None:
+            self.log(track, " ")
 
-            if self.mp3:
-                ffmpeg = FFmpeg().input(path).output(f"{extract_title(path)}.mp3")
+    def prepare(self):
+        self.metadata = None
 
-                @ffmpeg.on("progress")
-                def mp3_conv_progress(event):
-                    p = (to_sec(event.time) / int(yt.length)) * 100
-                    progress = (
-                        f"└── Converting to mp3 - [{p:.2f}%]"
-                        if p < 100
-                        else f"└── Converting to mp3 - {font.apply('bl', '[Done]          ')}"
-                    )
-
-                    end = "\n" if p >= 100 else "\r"
-                    print(progress, end=end, flush=True)
+        if self.metadata_filepath is not None:
+            if self.is_album:
+                tg = TitleGenerator(self.metadata_filepath, self.artist)
+            else:
+                tg = TitleGenerator(self.metadata_filepath, self.artist, no_album=True)
 
+            tg.make_titles()
+            self.metadata = tg.get_titles()
+
+        tracks = [Track(num, url, num + self.start + 1, self, self.job) for num, url in self.urls]
+        for track in tracks:
+            track.attempt = self.attempts[track.song] = self.attempts.get(track.song, 0) + 1
+        self.manifest = open_manifest(self.outdir)
+        for track in tracks:
+            self.resume_track(track)
+        return tracks
+
+    def run(self, tracks):
+        # download -> tag -> convert. Each stage only waits on the one before it, so the next track is already
+        # downloading while the previous one is being converted. Stages call into the Downloader that owns each
+        # track, so tracks from several playlists can share one pipeline
+        def stage(name):
+            return lambda track: getattr(track.downloader, name)(track)
+
+        # every Downloader with tracks in this run hands them to the same prefetcher
+        prefetcher = None
+        if self.prefetch > 0:
+            prefetcher = Prefetcher(stage("prefetch_track"), self.prefetch, key=lambda track: track.key)
+        # the limit outlives the run, so that retries start from what the last attempt settled on
+        if self.concurrency is None:
+            self.concurrency = AdaptiveLimit(self.jobs, self.max_jobs, on_change=self.concurrency_changed)
+        if shaper.shaping():
+            shaper.get_bucket().on_change = self.rate_changed
+        for track in tracks:
+            track.downloader.prefetcher = prefetcher
+            track.downloader.concurrency = self.concurrency
+
+        pipeline = self.pipeline = Pipeline(
+            on_done=stage("finish_track"),
+            on_error=lambda track, name, e: track.downloader.stage_failed(track, name, e),
+        )
+        if self.cancelled:
+            pipeline.cancel()
+        if self.stream:
+            pipeline.add_stage(
+                "stream", stage("stream_track"), workers=self.concurrency.maximum, limit=self.concurrency
+            )
+            pipeline.add_stage("tag", stage("tag_track"), workers=self.tag_workers, maxsize=self.jobs)
+        else:
+            pipeline.add_stage(
+                "download", stage("fetch_track"), workers=self.concurrency.maximum, limit=self.concurrency
+            )
+            if self.converting:
+                pipeline.add_stage("convert", stage("convert_track"), workers=os.cpu_count() or 1)
+            # tags are written to the file in the format it is left in
+            pipeline.add_stage("tag", stage("tag_track"), workers=self.tag_workers, maxsize=self.jobs)
+
+        self.progress.start()
+        if prefetcher is not None:
+            prefetcher.start(tracks)
+        try:
+            pipeline.run(tracks)
+        finally:
+            if prefetcher is not None:
+                prefetcher.stop()
+            self.progress.stop()
+            # tracks from several playlists may have been recorded in several manifests
+            for manifest in {id(t.downloader.manifest): t.downloader.manifest for t in tracks}.values():
                 try:
-                    loop.run_until_complete(ffmpeg.execute())
-                    os.remove(f"{extract_title(path)}.mp4")
-
-                except (Exception, KeyboardInterrupt) as e:
-                    print(
-                        f"└── Converting to mp3 - {font.apply('bf', '[Failed - ')} {font.apply('bf', str(e) + ']')}"
-                    )
+                    manifest.compact()
+                except OSError:
+                    # the journal is still there, and is replayed by the next run
+                    pass
+
+    def cancel(self):
+        # tracks that are already being processed run to the end of their current stage
+        self.cancelled = True
+        if self.pipeline is not None:
+            self.pipeline.cancel()
+
+    def collect(self, tracks):
+        # bookkeeping happens here, in playlist order, regardless of the order in which tracks finished. Only
+        # failures that may go away on their own are retried
+        for track in tracks:
+            if track.path is None:
+                failure = Failure(track, retry.classify(track.error))
+                self.failures[track.song] = failure
+                if failure.kind == retry.TRANSIENT:
+                    self.retry_urls.append((track.num, track.url))
+            else:
+                self.failures.pop(track.song, None)
+                self.successful_filepaths.append(track.path)
+                self.successful += 1
 
-            print(" ")
-        loop.close()
-        for image in self.to_delete:
-            os.remove(image)
+    def download(self):
+        tracks = self.prepare()
+        self.progress = ProgressRenderer(len(tracks))
+        self.console = TrackConsole((track.key for track in tracks), out=self.progress.println)
+        self.run(tracks)
+        self.collect(tracks)
 
     def set_retries(self):
         self.album_image_set = False